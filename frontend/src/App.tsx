@@ -40,14 +40,52 @@ export default function App() {
         })
       });
 
-      const reader = response.body?.getReader();
+      // Erros (ex: 429 "tutor ocupado") chegam como JSON, não como stream SSE
+      if (!response.ok || !response.body) {
+        const retryAfter = response.headers.get('Retry-After');
+        let detail = retryAfter
+          ? `O tutor está ocupado. Tente novamente em ${retryAfter}s.`
+          : 'O tutor não conseguiu responder agora. Tente novamente.';
+        try {
+          const body = await response.json();
+          if (typeof body?.detail === 'string') detail = body.detail;
+        } catch {
+          // Corpo vazio ou não-JSON: fica a mensagem padrão
+        }
+        addMessage('assistant', detail);
+        setStatus('IDLE');
+        return;
+      }
+
+      const reader = response.body.getReader();
       const decoder = new TextDecoder();
       let fullResponse = "";
+      let buffer = "";
 
+      // Stream SSE: eventos separados por linha em branco ("event: ..." + "data: {json}")
       while (true) {
-        const { done, value } = await reader!.read();
+        const { done, value } = await reader.read();
         if (done) break;
-        fullResponse += decoder.decode(value);
+        buffer += decoder.decode(value, { stream: true });
+
+        const events = buffer.split('\n\n');
+        buffer = events.pop() ?? "";
+        for (const raw of events) {
+          let event = 'message';
+          let data = '';
+          for (const line of raw.split('\n')) {
+            if (line.startsWith('event:')) event = line.slice(6).trim();
+            else if (line.startsWith('data:')) data += line.slice(5).trim();
+          }
+          // Comentários (": ping") não têm data
+          if (event === 'token' && data) fullResponse += JSON.parse(data).text;
+        }
+      }
+
+      // Stream sem nenhum token: nada para mostrar nem para sintetizar
+      if (!fullResponse.trim()) {
+        setStatus('IDLE');
+        return;
       }
 
       addMessage('assistant', fullResponse);
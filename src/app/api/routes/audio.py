@@ -1,36 +1,100 @@
-import shutil
-import uuid
-from fastapi import APIRouter, UploadFile, File, HTTPException
+import asyncio
+import orjson
+from fastapi import APIRouter, UploadFile, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import FileResponse, StreamingResponse
 # ALTERAÇÃO: Importando os Schemas centralizados (SOTA)
 from src.app.schemas.chat import SpeakRequest, TranscribeResponse
 from src.app.services.audio import audio_service
+from src.app.services.stt_pool import STTOverloaded, STTUnavailable
+from src.app.services.voice import voice_service
 from src.app.core.config import settings
 
 router = APIRouter()
 
+# Idiomas aceitos para fixar o STT (aluno brasileiro aprendendo inglês)
+SUPPORTED_LANGUAGES = {"pt", "en"}
+
+# Folga para o envelope multipart (boundaries, cabeçalhos das partes e o campo `language`)
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+def _limit_body(http_request: Request, max_bytes: int) -> Request:
+    """
+    Request cujo corpo é contado enquanto chega do socket: passou do limite, 413
+    no meio do upload (antes de o multipart terminar de ser lido e gravado em disco).
+    Cobre também uploads chunked, que não informam Content-Length.
+    """
+    receive = http_request.receive
+    received = 0
+
+    async def limited_receive():
+        nonlocal received
+        message = await receive()
+        if message["type"] == "http.request":
+            received += len(message.get("body", b""))
+            if received > max_bytes:
+                raise HTTPException(status_code=413, detail="Áudio muito grande")
+        return message
+
+    return Request(http_request.scope, limited_receive)
+
 @router.post("/transcribe", response_model=TranscribeResponse)
-async def transcribe_voice(file: UploadFile = File(...)):
-    """Recebe o arquivo .wav do microfone e retorna o texto (STT)"""
-    # Cria um nome temporário seguro
-    temp_path = settings.AUDIO_DIR / f"input_{uuid.uuid4()}.wav"
+async def transcribe_voice(http_request: Request):
+    """
+    Recebe o áudio do microfone (multipart: `file` + `language` opcional) e retorna o texto (STT).
+    O upload é lido de forma assíncrona e decodificado em memória.
+    `language` ("pt" | "en") fixa o idioma e pula a detecção automática.
+    Corpos acima do limite são recusados (413) antes do parse do multipart.
+    Com os workers STT saturados responde 503 com Retry-After.
+    """
+    max_body = settings.STT_MAX_AUDIO_BYTES + MULTIPART_OVERHEAD_BYTES
+
+    # Rejeição antecipada pelo Content-Length: nenhum byte do corpo chega a ser lido
+    content_length = http_request.headers.get("content-length")
+    if content_length is not None:
+        if not content_length.isdigit():
+            raise HTTPException(status_code=400, detail="Content-Length inválido")
+        if int(content_length) > max_body:
+            raise HTTPException(status_code=413, detail="Áudio muito grande")
 
+    form = await _limit_body(http_request, max_body).form(max_files=1, max_fields=1)
     try:
-        # 1. Salva o arquivo vindo do Browser no disco
-        with temp_path.open("wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        file = form.get("file")
+        language = form.get("language") or None
+        if not isinstance(file, UploadFile):
+            raise HTTPException(status_code=422, detail="Campo 'file' obrigatório")
+        if language is not None and language not in SUPPORTED_LANGUAGES:
+            raise HTTPException(status_code=400, detail=f"Idioma não suportado: {language}")
 
-        # 2. Chama a IA para transcrever
-        text = await audio_service.transcribe(str(temp_path))
+        # Lê no máximo limite + 1 byte: o suficiente para saber se estourou
+        audio = await file.read(settings.STT_MAX_AUDIO_BYTES + 1)
+    finally:
+        await form.close()
+
+    if len(audio) > settings.STT_MAX_AUDIO_BYTES:
+        raise HTTPException(status_code=413, detail="Áudio muito grande")
+    if not audio:
+        raise HTTPException(status_code=400, detail="Áudio vazio")
+
+    try:
+        text = await audio_service.transcribe(audio, language=language)
 
         # Retorna seguindo o padrão do Schema de resposta
         return TranscribeResponse(text=text if text else "")
 
+    except STTOverloaded as e:
+        raise HTTPException(
+            status_code=503,
+            detail=f"Reconhecimento de voz ocupado. Tente novamente em {e.retry_after}s.",
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    except STTUnavailable:
+        raise HTTPException(
+            status_code=503,
+            detail="Reconhecimento de voz reiniciando. Tente novamente em instantes.",
+            headers={"Retry-After": "5"}
+        )
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro no processamento de áudio: {str(e)}")
-    finally:
-        # Limpeza de arquivo temporário
-        if temp_path.exists():
-            temp_path.unlink()
 
 @router.post("/speak")
 async def generate_speech(request: SpeakRequest):
@@ -44,3 +108,84 @@ async def generate_speech(request: SpeakRequest):
         raise HTTPException(status_code=500, detail="Falha ao gerar áudio")
 
     return {"audio_url": audio_url}
+
+@router.post("/speak/stream")
+async def stream_speech(request: SpeakRequest):
+    """
+    TTS em stream: devolve o MP3 (audio/mpeg, chunked) conforme o Edge-TTS sintetiza,
+    sem esperar o arquivo inteiro nem exigir um segundo request para /static.
+    """
+    if not request.text:
+        raise HTTPException(status_code=400, detail="Texto vazio")
+
+    # Já sintetizado antes: serve direto do disco (com cache imutável no navegador)
+    cached = audio_service.get_cached_audio(request.text)
+    if cached is not None:
+        return FileResponse(
+            cached,
+            media_type="audio/mpeg",
+            headers={"Cache-Control": "public, max-age=31536000, immutable"}
+        )
+
+    return StreamingResponse(
+        audio_service.speech_chunks(request.text),
+        media_type="audio/mpeg",
+        headers={"Cache-Control": "no-cache"}
+    )
+
+async def _run_voice_turn(websocket: WebSocket, audio: bytes, session_id: str, level: str):
+    """Transcreve o áudio do turno e envia a resposta (eventos JSON + frames MP3 binários)."""
+    try:
+        async for frame in voice_service.converse(audio, session_id, level):
+            if isinstance(frame, bytes):
+                await websocket.send_bytes(frame)
+            else:
+                await websocket.send_text(orjson.dumps(frame).decode("utf-8"))
+    except WebSocketDisconnect:
+        pass
+
+@router.websocket("/voice")
+async def voice_conversation(websocket: WebSocket, session_id: str, level: str = "beginner"):
+    """
+    Conversa por voz full-duplex (STT -> LLM -> TTS por frase numa única conexão).
+
+    Cliente -> servidor: frames binários com o áudio do turno, depois {"type": "end"}.
+    {"type": "cancel"} interrompe a resposta em andamento (um novo "end" também interrompe).
+    Servidor -> cliente: {"type": "transcript"} (ou {"type": "busy", "retry_after"}),
+    {"type": "token"}, {"type": "queued"},
+    {"type": "audio_start", "index", "text"} + frames MP3 binários + {"type": "audio_end"},
+    e por fim {"type": "done", ...metadados}.
+    """
+    await websocket.accept()
+    audio = bytearray()
+    turn: asyncio.Task | None = None
+
+    def interrupt():
+        if turn is not None and not turn.done():
+            turn.cancel()
+
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+
+            if message.get("bytes"):
+                audio.extend(message["bytes"])
+                if len(audio) > settings.STT_MAX_AUDIO_BYTES:
+                    await websocket.close(code=1009, reason="Áudio muito grande")
+                    break
+                continue
+
+            command = orjson.loads(message.get("text") or "{}").get("type")
+            if command == "end" and audio:
+                interrupt()
+                turn = asyncio.create_task(_run_voice_turn(websocket, bytes(audio), session_id, level))
+                audio.clear()
+            elif command == "cancel":
+                interrupt()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        # Cliente saiu: aborta STT/LLM/TTS pendentes
+        interrupt()
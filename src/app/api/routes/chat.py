@@ -1,8 +1,10 @@
 # src/app/api/routes/chat.py
 
-from fastapi import APIRouter
+from fastapi import APIRouter, HTTPException, Request
 from fastapi.responses import StreamingResponse
 from src.app.services.chat import chat_service
+from src.app.services.admission import admission_controller, AdmissionRejected
+from src.app.services.streaming import sse_stream
 from pydantic import BaseModel
 
 router = APIRouter()
@@ -13,16 +15,35 @@ class ChatRequest(BaseModel):
     level: str = "beginner" # <--- ADICIONADO: Nível opcional (padrão iniciante)
 
 @router.post("/chat")
-async def chat_endpoint(request: ChatRequest):
+async def chat_endpoint(request: ChatRequest, http_request: Request):
     """
     Endpoint de chat com streaming.
     Agora passa o session_id para o orquestrador gerenciar a memória no Redis.
+    Sob sobrecarga (fila cheia ou sessão já gerando) responde 429 com Retry-After.
+
+    Formato SSE: `event: token` ({"text"}), `event: queued` ({"position"}),
+    `event: done` (metadados: cache, intent, ok) e comentários `: ping` de keep-alive.
+    Se o cliente fechar a conexão, a geração no Ollama é abortada.
     """
+    try:
+        admission_controller.check(request.session_id)
+    except AdmissionRejected as e:
+        raise HTTPException(
+            status_code=429,
+            detail=f"Tutor ocupado ({e.reason}). Tente novamente em {e.retry_after}s.",
+            headers={"Retry-After": str(e.retry_after)}
+        )
+
     return StreamingResponse(
-        chat_service.process_message(
-            user_message=request.message,
-            session_id=request.session_id, # <--- PASSANDO O ID
-            student_level=request.level
+        sse_stream(
+            chat_service.process_message(
+                user_message=request.message,
+                session_id=request.session_id, # <--- PASSANDO O ID
+                student_level=request.level
+            ),
+            is_disconnected=http_request.is_disconnected
         ),
-        media_type="text/event-stream"
+        media_type="text/event-stream",
+        # Sem cache e sem buffering em proxies (Nginx) para os eventos chegarem na hora
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
     )
@@ -12,9 +12,84 @@ class Settings(BaseSettings):
   # IA Configs
   OLLAMA_BASE_URL: str
   MODEL_NAME: str
+  OLLAMA_KEEP_ALIVE: str = "30m" # Mantém os modelos carregados na RAM entre requisições
+  LLM_NUM_CTX: int = 4096                 # Janela de contexto enviada ao Ollama
+  LLM_RESPONSE_RESERVE_TOKENS: int = 512  # Espaço reservado para a resposta dentro do num_ctx
+  LLM_TEMPERATURE: float = 0.7
+
+  # Perfis de geração por intenção do roteador (chaves ausentes herdam os valores globais acima)
+  # Chaves aceitas: model, num_ctx, num_predict, temperature, keep_alive
+  # num_ctx só é respeitado em modelos diferentes do MODEL_NAME: mudar o num_ctx do mesmo
+  # modelo faz o Ollama recarregar o runner a cada troca de intenção
+  LLM_FAST_MODEL: str | None = None  # Modelo pequeno para chitchat (ex: "qwen2.5:0.5b"); None = MODEL_NAME
+  LLM_PROFILES: dict[str, dict] = {
+      "chitchat": {"num_predict": 160, "temperature": 0.8},
+      "rag_ingles": {"num_predict": 512, "temperature": 0.4},
+  }
+
+  # Controle de admissão do LLM (evita sobrecarregar a máquina de inferência)
+  LLM_MAX_CONCURRENCY: int = 2  # Gerações simultâneas no Ollama
+  LLM_MAX_QUEUE: int = 16       # Fila máxima antes de responder 429
+  LLM_RETRY_AFTER: int = 10     # Estimativa inicial (s) da duração de uma geração
+
+  # Streaming SSE do /chat (agrupamento de tokens antes de cada escrita)
+  SSE_FLUSH_INTERVAL_MS: float = 50.0
+  SSE_FLUSH_MAX_CHARS: int = 256
+  SSE_HEARTBEAT_SECONDS: float = 15.0
+
+  # Memória de sessão
+  HISTORY_MODE: str = "window"     # "window" (últimas N mensagens) | "tokens" (orçamento de tokens)
+  HISTORY_WINDOW_SIZE: int = 10    # N do modo "window"
+  HISTORY_MAX_MESSAGES: int = 50   # Quantas mensagens o Redis guarda no modo "tokens"
+  HISTORY_SUMMARY_ENABLED: bool = True  # Resume (em background) os turnos que saem da janela
+  HISTORY_SUMMARY_MAX_TOKENS: int = 200
+  HISTORY_SUMMARY_BATCH: int = 6   # Mensagens despejadas acumuladas antes de chamar o LLM para resumir
+
+  # Embeddings (modelo + cache em duas camadas: LRU local e Redis compartilhado)
+  EMBEDDING_MODEL: str = "nomic-embed-text"
+  EMBEDDING_CACHE_SIZE: int = 2048
+  EMBEDDING_CACHE_TTL: int = 604800 # 7 dias
+  # Micro-batching: agrupa pedidos concorrentes numa única chamada /api/embed
+  EMBEDDING_BATCH_WINDOW_MS: float = 5.0
+  EMBEDDING_BATCH_MAX_SIZE: int = 32
+
+  # Cache semântico (distância cosseno máxima para considerar HIT)
+  SEMANTIC_CACHE_THRESHOLD: float = 0.35
+  CACHE_MAX_ENTRIES: int = 5000    # Orçamento (despejo LFU acima disso)
+  CACHE_BASE_TTL: int = 900        # TTL de uma entrada nova (dobra a cada hit)
+  CACHE_MAX_TTL: int = 86400       # Teto do TTL adaptativo
+
+  # Cache exato de respostas (GET no Redis + LRU local, antes de qualquer embedding)
+  EXACT_CACHE_SIZE: int = 512
+  EXACT_CACHE_LOCAL_TTL: int = 60 # segundos que uma resposta vive no LRU local
+
+  # Voz (STT + TTS)
+  STT_MODEL_SIZE: str = "small"
+  STT_WORKERS: int = 0                # Processos Whisper (0 = automático: 1 a cada 4 núcleos)
+  STT_CPU_THREADS: int = 0            # Threads por processo (0 = núcleos / workers)
+  STT_MAX_QUEUE: int = 8              # Clipes aguardando além dos que estão decodificando (acima: 503)
+  STT_BATCH_SIZE: int = 8             # Lote de trechos (VAD) por clipe longo (BatchedInferencePipeline)
+  STT_BATCH_MIN_SECONDS: float = 30.0 # Clipes a partir daqui são decodificados em lote
+  STT_MAX_AUDIO_BYTES: int = 10 * 1024 * 1024  # Limite de áudio recebido por turno (acima: 413)
+  STT_LANGUAGE: str | None = None     # Idioma fixo ("pt" | "en"); None = detecção automática
+  STT_VAD_FILTER: bool = True         # Corta silêncios antes de decodificar (Silero VAD)
+  STT_BEAM_SIZE: int = 5              # Beam para clipes longos
+  STT_SHORT_CLIP_SECONDS: float = 4.0 # Clipes até aqui usam decodificação gulosa (beam 1)
+  STT_SILENCE_RMS: float = 0.003      # Abaixo dessa energia o clipe é tratado como silêncio
+  VOICE_MIN_SENTENCE_CHARS: int = 24  # Frases menores são juntadas antes de sintetizar
+  VOICE_TTS_PREFETCH: int = 2         # Frases sintetizadas em paralelo à frente da que está tocando
+  TTS_VOICE: str = "pt-BR-AntonioNeural"
+  TTS_RATE: str = "+0%"
+  TTS_CACHE_MAX_BYTES: int = 512 * 1024 * 1024  # Orçamento de disco do cache de áudio (despejo LRU)
+
+  # Warmup: componentes que falharam são tentados de novo com backoff exponencial
+  WARMUP_RETRY_BASE_SECONDS: float = 2.0
+  WARMUP_RETRY_MAX_SECONDS: float = 60.0
 
   # Infra Configs
   REDIS_URL: str
+  REDIS_MAX_CONNECTIONS: int = 50 # Tamanho do pool compartilhado entre todos os serviços
+  REDIS_POOL_TIMEOUT: float = 5.0 # Espera máxima (s) por uma conexão livre do pool
 
   # Caminhos (Pathlib facilita manipulação)
   AUDIO_DIR: Path
@@ -0,0 +1,17 @@
+from redis.asyncio import BlockingConnectionPool, Redis
+from src.app.core.config import settings
+
+# Pool ÚNICO de conexões compartilhado por todos os serviços (cache, memória, RAG, roteador...)
+# Modo raw bytes: vetores float32 trafegam como bytes; quem precisa de texto decodifica.
+# Bloqueante: num pico, quem não acha conexão livre espera até REDIS_POOL_TIMEOUT em vez de
+# receber "Too many connections" na hora.
+redis_pool = BlockingConnectionPool.from_url(
+    settings.REDIS_URL,
+    max_connections=settings.REDIS_MAX_CONNECTIONS,
+    timeout=settings.REDIS_POOL_TIMEOUT,
+    decode_responses=False
+)
+
+def get_redis() -> Redis:
+    """Cliente leve sobre o pool compartilhado (não abre conexões próprias)."""
+    return Redis(connection_pool=redis_pool)
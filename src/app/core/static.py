@@ -0,0 +1,14 @@
+import os
+from fastapi.staticfiles import StaticFiles
+
+class CachedStaticFiles(StaticFiles):
+    """
+    StaticFiles com cache imutável para os áudios endereçados por conteúdo (tts_<sha256>.mp3):
+    o nome muda sempre que o conteúdo muda, então o navegador nunca precisa revalidar.
+    """
+
+    def file_response(self, full_path, stat_result, scope, status_code: int = 200):
+        response = super().file_response(full_path, stat_result, scope, status_code)
+        if os.path.basename(full_path).startswith("tts_"):
+            response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+        return response
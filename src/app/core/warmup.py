@@ -0,0 +1,71 @@
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable
+from src.app.core.config import settings
+
+logger = logging.getLogger("brazuka_warmup")
+
+class WarmupOrchestrator:
+    """
+    Executa, em paralelo no startup, todo o trabalho caro que antes
+    acontecia na primeira requisição (índices, Whisper, centroides, modelos do Ollama).
+    Componentes que falham (ex: Ollama ou Redis ainda subindo) são tentados de novo
+    com backoff exponencial até ficarem prontos, sem reiniciar o processo.
+    Mantém o status e o tempo de cada componente para o endpoint /ready.
+    """
+
+    def __init__(self):
+        self.steps: dict[str, Callable[[], Awaitable]] = {}
+        self.status: dict[str, dict] = {}
+        self.started_at: float | None = None
+        self.total_ms: float | None = None
+
+    def register(self, name: str, step: Callable[[], Awaitable]):
+        self.steps[name] = step
+        self.status[name] = {"status": "pending", "duration_ms": None}
+
+    async def _run_step(self, name: str, step: Callable[[], Awaitable]):
+        delay = settings.WARMUP_RETRY_BASE_SECONDS
+        attempts = 0
+        while True:
+            attempts += 1
+            start = time.perf_counter()
+            try:
+                await step()
+                self.status[name] = {"status": "ok", "attempts": attempts}
+                logger.info(f"🔥 Warmup '{name}' concluído")
+                break
+            except Exception as e:
+                self.status[name] = {
+                    "status": "failed",
+                    "error": str(e),
+                    "attempts": attempts,
+                    "retry_in_s": delay
+                }
+                logger.error(f"❌ Warmup '{name}' falhou (tentativa {attempts}, nova tentativa em {delay}s): {e}")
+            finally:
+                self.status[name]["duration_ms"] = round((time.perf_counter() - start) * 1000, 1)
+
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, settings.WARMUP_RETRY_MAX_SECONDS)
+
+    async def run(self):
+        self.started_at = time.perf_counter()
+        await asyncio.gather(*(self._run_step(name, step) for name, step in self.steps.items()))
+        self.total_ms = round((time.perf_counter() - self.started_at) * 1000, 1)
+        logger.info(f"✅ Warmup finalizado em {self.total_ms} ms (pronto: {self.ready})")
+
+    @property
+    def ready(self) -> bool:
+        return bool(self.status) and all(s["status"] == "ok" for s in self.status.values())
+
+    def report(self) -> dict:
+        return {
+            "ready": self.ready,
+            "total_ms": self.total_ms,
+            "components": self.status
+        }
+
+# Instância Singleton
+warmup = WarmupOrchestrator()
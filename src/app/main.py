@@ -1,8 +1,9 @@
+import asyncio
 import logging
 from contextlib import asynccontextmanager
 
 from fastapi import FastAPI
-from fastapi.staticfiles import StaticFiles
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 
 import httpx
@@ -11,6 +12,17 @@ from src.app.core.logging import setup_logging
 from src.app.api.routes import chat, audio
 from src.app.core.config import settings
 from src.app.api.routes import chat
+from src.app.core.warmup import warmup
+from src.app.core.static import CachedStaticFiles
+from src.app.services.router import router_service
+from src.app.services.jobs import job_queue
+from src.app.services.cache import cache_service
+from src.app.services.audio import audio_service
+from src.app.services.stt_pool import whisper_pool
+from src.app.services.llm import llm_service
+from src.app.services.embedding import embedding_service
+from src.app.services.admission import admission_controller
+from src.app.rag.retriever import vector_store
 
 # Configuração de Logs
 logging.basicConfig(
@@ -44,9 +56,28 @@ async def lifespan(app: FastAPI):
   except Exception as e:
     logger.critical(f"❌ FALHA CRÍTICA: Não foi possível conectar ao Ollama em {settings.OLLAMA_BASE_URL}. Verifique se ele está rodando. Erro: {e}")
 
+  # 2. Warmup concorrente: tudo que antes pesava na primeira requisição
+  # Roda em background: /health responde já, /ready só fica verde com tudo aquecido
+  warmup_task = asyncio.create_task(warmup.run())
+
   yield
 
   logger.info("🛑 Desligando aplicação...")
+  warmup_task.cancel()
+  await job_queue.close()
+  whisper_pool.shutdown()
+
+async def _warm_router():
+  await router_service.warmup()
+  if not router_service.is_ready:
+    raise RuntimeError("centroides do roteador não foram gerados")
+
+warmup.register("cache_index", cache_service.create_index)
+warmup.register("knowledge_index", vector_store.create_index)
+warmup.register("stt_model", audio_service.warmup)
+warmup.register("router_centroids", _warm_router)
+warmup.register("chat_model", llm_service.warmup)
+warmup.register("embedding_model", embedding_service.warmup)
 
 setup_logging()
 
@@ -65,7 +96,7 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-app.mount("/static", StaticFiles(directory="static"), name="static")
+app.mount("/static", CachedStaticFiles(directory="static"), name="static")
 
 # Registro de Rotas
 app.include_router(chat.router, prefix=settings.API_V1_STR, tags=["Chat"])
@@ -81,6 +112,22 @@ async def health_check():
       "mode": "distributed_mvp"
   }
 
+# Rota de Prontidão (Readiness): o load balancer só envia tráfego para workers aquecidos
+@app.get("/ready")
+async def readiness_check():
+  report = warmup.report()
+  return JSONResponse(report, status_code=200 if report["ready"] else 503)
+
+# Rota de Métricas: contadores em memória deste processo (um snapshot por worker uvicorn)
+@app.get("/metrics")
+async def metrics():
+  return {
+      "llm": llm_service.stats(),
+      "admission": admission_controller.stats(),
+      "embedding": embedding_service.stats(),
+      "stt": whisper_pool.stats(),
+  }
+
 # Endpoint de teste rápido (só pra você ver a IA funcionando no navegador)
 @app.get("/test-ai")
 async def test_ai_connection():
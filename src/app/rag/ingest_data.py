@@ -4,6 +4,7 @@ import logging
 import os
 from pathlib import Path
 from src.app.rag.retriever import vector_store
+from src.app.services.cache import cache_service
 from src.app.utils.converter import convert_to_markdown
 
 # Configuração de Logs
@@ -17,18 +18,15 @@ async def ingest_json(file_path: Path):
         with open(file_path, "r", encoding="utf-8") as f:
             data = json.load(f)
 
-        count = 0
+        documents = []
         for item in data:
             # Cria um documento rico semanticamente
             enriched_content = f"TOPIC: {item.get('topic', 'General')}\nCONTENT: {item.get('content', '')}"
+            documents.append((enriched_content, item.get('metadata', {}), "pedagogical_rule"))
 
-            await vector_store.add_document(
-                content=enriched_content,
-                metadata=item.get('metadata', {}),
-                topic="pedagogical_rule"
-            )
-            count += 1
-        logger.info(f"✅ JSON Finalizado: {count} itens inseridos.")
+        # Embeddings em lote (micro-batching) em vez de um item por vez
+        await vector_store.add_documents(documents)
+        logger.info(f"✅ JSON Finalizado: {len(documents)} itens inseridos.")
     except Exception as e:
         logger.error(f"Erro no JSON {file_path.name}: {e}")
 
@@ -77,6 +75,9 @@ async def run_ingestion():
         else:
             logger.debug(f"Ignorando arquivo desconhecido: {file_path.name}")
 
+    # 4. Invalida respostas cacheadas construídas sobre o conhecimento antigo
+    await cache_service.bump_version()
+
     logger.info("🎉 Ingestão Híbrida Concluída!")
 
 if __name__ == "__main__":
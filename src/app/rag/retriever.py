@@ -1,28 +1,26 @@
+import hashlib
 import logging
-import numpy as np
-import ollama
 from redis.asyncio import Redis
+from src.app.core.redis import get_redis
 from redis.commands.search.field import VectorField, TextField, TagField
 from redis.commands.search.indexDefinition import IndexDefinition, IndexType
 from redis.commands.search.query import Query
 from redis.exceptions import ResponseError
 
 from src.app.core.config import settings
+from src.app.services.embedding import QueryEmbedding, embedding_service
 
 # Configuração de Logs
 logger = logging.getLogger("brazuka_rag")
 
 class VectorStoreManager:
-    def __init__(self):
-        # Conexão assíncrona com Redis (decode_responses=False para lidar com bytes de vetores)
-        self.redis = Redis.from_url(settings.REDIS_URL, decode_responses=False)
-
-        # Cliente para gerar Embeddings (usando o host configurado)
-        self.client = ollama.AsyncClient(host=settings.OLLAMA_BASE_URL)
+    def __init__(self, redis: Redis | None = None):
+        # Conexão do pool compartilhado (raw bytes para lidar com vetores)
+        self.redis = redis or get_redis()
 
         # Configurações do Índice SOTA
         self.index_name = "brazuka_knowledge"
-        self.embedding_model = "nomic-embed-text"
+        self.embedding_model = settings.EMBEDDING_MODEL
         self.vector_dim = 768  # Dimensão exata do nomic-embed-text v1.5
         self.distance_metric = "COSINE"  # Melhor métrica para similaridade de texto
 
@@ -61,44 +59,54 @@ class VectorStoreManager:
             logger.info("✅ Índice 'brazuka_knowledge' criado com sucesso.")
 
     async def _get_embedding(self, text: str) -> bytes:
-        """Gera o vetor numérico (embedding) usando Ollama e converte para bytes."""
-        try:
-            response = await self.client.embeddings(
-                model=self.embedding_model,
-                prompt=text
-            )
-            # Converte lista de floats para array numpy float32 e depois para bytes
-            return np.array(response["embedding"], dtype=np.float32).tobytes()
-        except Exception as e:
-            logger.error(f"Erro ao gerar embedding no Ollama: {e}")
-            raise
+        """Gera o vetor numérico (embedding) via serviço compartilhado e converte para bytes."""
+        # O EmbeddingService já loga e propaga falhas do Ollama
+        vector = await embedding_service.embed(text)
+        return vector.tobytes()
+
+    def _get_doc_id(self, content: str) -> str:
+        # ID único determinístico baseado no conteúdo (evita duplicatas entre execuções)
+        return f"doc:{hashlib.sha256(content.encode('utf-8')).hexdigest()}"
 
     async def add_document(self, content: str, metadata: dict = {}, topic: str = "general"):
         """Ingere um documento no Redis (Hash + Vetor)."""
-        vector_bytes = await self._get_embedding(content)
+        await self.add_documents([(content, metadata, topic)])
 
-        # ID único determinístico baseado no conteúdo (evita duplicatas)
-        doc_id = f"doc:{hash(content)}"
-
-        mapping = {
-            "topic": topic,
-            "content": content,
-            "metadata": str(metadata),
-            "embedding": vector_bytes
-        }
-
-        # Salva como HASH no Redis
-        await self.redis.hset(doc_id, mapping=mapping)
-        logger.debug(f"Documento ingerido: {doc_id}")
-
-    async def search(self, query: str, k: int = 3) -> list[str]:
+    async def add_documents(self, documents: list[tuple[str, dict, str]]):
+        """
+        Ingere vários documentos (conteúdo, metadados, tópico) de uma vez.
+        Os embeddings são gerados em lote e as escritas vão num único pipeline.
+        """
+        if not documents:
+            return
+
+        vectors = await embedding_service.embed_many([content for content, _, _ in documents])
+
+        pipe = self.redis.pipeline(transaction=False)
+        for (content, metadata, topic), vector in zip(documents, vectors):
+            doc_id = self._get_doc_id(content)
+            mapping = {
+                "topic": topic,
+                "content": content,
+                "metadata": str(metadata),
+                "embedding": vector.tobytes()
+            }
+            # Salva como HASH no Redis
+            pipe.hset(doc_id, mapping=mapping)
+            logger.debug(f"Documento ingerido: {doc_id}")
+        await pipe.execute()
+
+    async def search(self, query: str, k: int = 3, embedding: QueryEmbedding | None = None) -> list[str]:
         """
         Realiza a Busca Vetorial (KNN) para encontrar os contextos mais relevantes.
         Retorna uma lista de strings (conteúdos).
         """
         try:
-            # 1. Gera vetor da pergunta
-            query_vector = await self._get_embedding(query)
+            # 1. Gera vetor da pergunta (ou reaproveita o embedding do turno)
+            if embedding is not None:
+                query_vector = await embedding.as_bytes()
+            else:
+                query_vector = await self._get_embedding(query)
 
             # 2. Constrói a Query do RediSearch
             # Sintaxe: Retorne os K vizinhos mais próximos ($vec) do campo @embedding
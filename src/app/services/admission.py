@@ -0,0 +1,140 @@
+import asyncio
+import logging
+import math
+import time
+from collections import deque
+from src.app.core.config import settings
+
+logger = logging.getLogger("brazuka_admission")
+
+class AdmissionRejected(Exception):
+    """Geração recusada na porta (fila cheia ou sessão já gerando). Vira HTTP 429."""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+class AdmissionTicket:
+    """Reserva de uma vaga de geração: posição na fila, espera e liberação."""
+
+    def __init__(self, controller: "AdmissionController", session_id: str, waiter: asyncio.Future | None):
+        self.controller = controller
+        self.session_id = session_id
+        self._waiter = waiter
+        self._acquired = waiter is None
+        self._released = False
+        self.position = controller.position_of(waiter)
+        # Início da geração (não da espera): base da média de duração
+        self.started_at = time.monotonic() if self._acquired else None
+
+    async def acquire(self):
+        """Aguarda a vez na fila FIFO (retorna imediatamente se já havia vaga livre)."""
+        if self._acquired:
+            return
+        try:
+            await self._waiter
+        except asyncio.CancelledError:
+            # A vaga pode ter sido repassada no exato momento do cancelamento: devolve adiante
+            if self._waiter.done() and not self._waiter.cancelled():
+                self._acquired = True
+            self.release()
+            raise
+        self._acquired = True
+        self.started_at = time.monotonic()
+
+    def release(self):
+        if self._released:
+            return
+        self._released = True
+        self.controller._release(self)
+
+class AdmissionController:
+    """
+    Controle de admissão na frente do LLM.
+    - No máximo LLM_MAX_CONCURRENCY gerações simultâneas (o "ponto doce" do hardware).
+    - Fila FIFO limitada a LLM_MAX_QUEUE; acima disso, recusa rápida com Retry-After.
+    - Justiça por sessão: cada sessão tem no máximo UMA geração em andamento/na fila.
+    """
+
+    def __init__(self):
+        self.max_concurrency = settings.LLM_MAX_CONCURRENCY
+        self.max_queue = settings.LLM_MAX_QUEUE
+
+        self.active = 0
+        self._queue: deque[asyncio.Future] = deque()
+        self._sessions: set[str] = set()
+
+        # Média móvel (EWMA) da duração de uma geração, usada para estimar o Retry-After
+        self.avg_duration = float(settings.LLM_RETRY_AFTER)
+
+    def _retry_after(self) -> int:
+        waves = (len(self._queue) + 1) / self.max_concurrency
+        return max(1, math.ceil(self.avg_duration * waves))
+
+    def position_of(self, waiter: asyncio.Future | None) -> int:
+        """0 = vai gerar agora; N = N-ésimo da fila."""
+        if waiter is None:
+            return 0
+        return self._queue.index(waiter) + 1 if waiter in self._queue else 0
+
+    def check(self, session_id: str):
+        """Pré-checagem barata (usada pela rota antes de abrir o stream)."""
+        if session_id in self._sessions:
+            raise AdmissionRejected("session_busy", self._retry_after())
+        if self.active >= self.max_concurrency and len(self._queue) >= self.max_queue:
+            raise AdmissionRejected("queue_full", self._retry_after())
+
+    def reserve(self, session_id: str) -> AdmissionTicket:
+        """Reserva uma vaga (imediata ou na fila). Levanta AdmissionRejected se não couber."""
+        self.check(session_id)
+        self._sessions.add(session_id)
+
+        waiter = None
+        if self.active < self.max_concurrency and not self._queue:
+            self.active += 1
+        else:
+            waiter = asyncio.get_running_loop().create_future()
+            self._queue.append(waiter)
+
+        ticket = AdmissionTicket(self, session_id, waiter)
+        if ticket.position:
+            logger.info(f"⏳ Geração na fila (posição {ticket.position})")
+        return ticket
+
+    def reserve_background(self, key: str) -> AdmissionTicket:
+        """
+        Vaga de BAIXA prioridade (ex: resumo de conversa): só entra com slot livre e fila
+        vazia, e nunca espera na fila. Com o LLM ocupado levanta AdmissionRejected.
+        """
+        if self.active >= self.max_concurrency or self._queue or key in self._sessions:
+            raise AdmissionRejected("busy", self._retry_after())
+        self._sessions.add(key)
+        self.active += 1
+        return AdmissionTicket(self, key, None)
+
+    def _release(self, ticket: AdmissionTicket):
+        self._sessions.discard(ticket.session_id)
+
+        if not ticket._acquired:
+            # Desistiu ainda na fila: só sai da fila
+            if ticket._waiter in self._queue:
+                self._queue.remove(ticket._waiter)
+            return
+
+        if ticket.started_at is not None:
+            self.avg_duration = 0.8 * self.avg_duration + 0.2 * (time.monotonic() - ticket.started_at)
+
+        # Repassa a vaga para o próximo da fila (FIFO) ou libera o slot
+        while self._queue:
+            waiter = self._queue.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    def stats(self) -> dict:
+        return {"active": self.active, "queued": len(self._queue), "avg_duration_s": round(self.avg_duration, 2)}
+
+# Instância Singleton
+admission_controller = AdmissionController()
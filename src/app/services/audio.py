@@ -1,38 +1,67 @@
 import os
+import hashlib
 import logging
 import asyncio
 import uuid
 import edge_tts
 from pathlib import Path
-from faster_whisper import WhisperModel
+from typing import AsyncGenerator
 # ALTERAÇÃO: Importando biblioteca de resiliência SOTA
 from tenacity import retry, stop_after_attempt, wait_exponential
 from src.app.core.config import settings
+from src.app.services.stt_pool import STTOverloaded, STTUnavailable, whisper_pool
+from src.app.utils.pcm import decode_pcm, duration_of, rms_of
 
 logger = logging.getLogger("brazuka_audio")
 
 class AudioService:
     def __init__(self):
-        # Configuração do STT (Faster-Whisper) - Otimizado para seu i3
-        self.stt_model_size = "small"
-        self.stt_model = None # Lazy loading: só carrega quando usar
-
-    def _get_stt_model(self):
-        """Carrega o modelo Whisper apenas quando necessário (economiza RAM no boot)"""
-        if self.stt_model is None:
-            logger.info(f"📥 Carregando modelo STT Whisper ({self.stt_model_size})...")
-            # compute_type="int8" reduz o uso de RAM pela metade sem perder precisão
-            self.stt_model = WhisperModel(self.stt_model_size, device="cpu", compute_type="int8", cpu_threads=4)
-        return self.stt_model
-
-    async def transcribe(self, audio_path: str) -> str:
-        """Converte áudio (STT) de forma assíncrona."""
+        # Voz do TTS (Edge-TTS) e cache de áudio endereçado por conteúdo
+        self.tts_voice = settings.TTS_VOICE
+        self.tts_rate = settings.TTS_RATE
+        self.tts_cache_budget = settings.TTS_CACHE_MAX_BYTES
+        self._tts_cache_bytes: int | None = None  # Calculado no primeiro uso (varredura do diretório)
+        self._tts_inflight: dict[str, asyncio.Future] = {}
+
+    async def warmup(self):
+        """Sobe os workers STT (cada um com seu modelo Whisper) no startup."""
+        await whisper_pool.warmup()
+
+    def _get_beam_size(self, duration: float) -> int:
+        """Beam adaptativo: clipes curtos (a maioria das falas) usam decodificação gulosa."""
+        return 1 if duration <= settings.STT_SHORT_CLIP_SECONDS else settings.STT_BEAM_SIZE
+
+    async def transcribe(self, audio: str | bytes, language: str | None = None) -> str:
+        """
+        Converte áudio (STT) de forma assíncrona.
+        Aceita um caminho de arquivo ou os bytes do upload (decodificados em memória, sem disco).
+        A inferência roda no pool de processos Whisper; fila cheia levanta STTOverloaded
+        e worker morto levanta STTUnavailable (nunca um texto vazio silencioso).
+        """
         try:
-            model = self._get_stt_model()
-            # Whisper é síncrono, então rodamos em uma thread separada para não travar o server
-            segments, _ = await asyncio.to_thread(model.transcribe, audio_path, beam_size=5)
-            text = " ".join([segment.text for segment in segments])
-            return text.strip()
+            batch_size = 1
+            beam_size = settings.STT_BEAM_SIZE
+
+            if isinstance(audio, bytes):
+                audio = await asyncio.to_thread(decode_pcm, audio)
+
+                # Silêncio (ou quase) não vale uma passada do modelo
+                if rms_of(audio) < settings.STT_SILENCE_RMS:
+                    logger.info("🔇 Clipe silencioso: transcrição ignorada")
+                    return ""
+                duration = duration_of(audio)
+                beam_size = self._get_beam_size(duration)
+                if duration >= settings.STT_BATCH_MIN_SECONDS:
+                    batch_size = settings.STT_BATCH_SIZE
+
+            options = {
+                "beam_size": beam_size,
+                "language": language or settings.STT_LANGUAGE,
+                "vad_filter": settings.STT_VAD_FILTER,
+            }
+            return await whisper_pool.transcribe(audio, options, batch_size=batch_size)
+        except (STTOverloaded, STTUnavailable):
+            raise
         except Exception as e:
             logger.error(f"Erro na transcrição: {e}")
             return ""
@@ -45,25 +74,149 @@ class AudioService:
     )
     async def _execute_tts(self, text: str, output_path: Path):
         """Executa a síntese de voz com lógica de retry automático."""
-        communicate = edge_tts.Communicate(text, "pt-BR-AntonioNeural")
-        await communicate.save(str(output_path))
+        communicate = edge_tts.Communicate(text, self.tts_voice, rate=self.tts_rate)
+        # Escreve num temporário e renomeia: quem serve o arquivo nunca vê um MP3 pela metade
+        tmp_path = output_path.with_suffix(f".{uuid.uuid4().hex}.tmp")
+        try:
+            await communicate.save(str(tmp_path))
+            os.replace(tmp_path, output_path)
+        finally:
+            if tmp_path.exists():
+                tmp_path.unlink()
 
-    async def speak(self, text: str) -> str:
-        """Gera áudio (TTS) via Edge-TTS (Custo zero de CPU local) com tolerância a falhas."""
+    def _get_audio_name(self, text: str) -> str:
+        """Nome endereçado por conteúdo: sha256(voz + velocidade + texto)."""
+        digest = hashlib.sha256(f"{self.tts_voice}\x00{self.tts_rate}\x00{text}".encode("utf-8")).hexdigest()
+        return f"tts_{digest}.mp3"
+
+    def _touch(self, path: Path) -> bool:
+        """Marca o áudio como usado agora (o mtime é a ordem do LRU). False se não existir."""
         try:
-            filename = f"{uuid.uuid4()}.mp3"
-            # settings.AUDIO_DIR aponta para ./static/audio
-            output_path = settings.AUDIO_DIR / filename
+            os.utime(path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def _evict_audio(self) -> int:
+        """Apaga os MP3 menos usados (mtime mais antigo) até caber no orçamento. Retorna o total."""
+        files = []
+        with os.scandir(settings.AUDIO_DIR) as entries:
+            for entry in entries:
+                if entry.is_file() and entry.name.endswith(".mp3"):
+                    stat = entry.stat()
+                    files.append((stat.st_mtime, stat.st_size, entry.path))
 
+        total = sum(size for _, size, _ in files)
+        evicted = 0
+        for _, size, path in sorted(files):
+            if total <= self.tts_cache_budget:
+                break
+            try:
+                os.remove(path)
+                total -= size
+                evicted += 1
+            except FileNotFoundError:
+                pass
+
+        if evicted:
+            logger.info(f"🧹 Cache de áudio: {evicted} arquivos despejados ({total} bytes em uso)")
+        return total
+
+    def _store_audio(self, output_path: Path, audio: bytes):
+        """Grava o MP3 já sintetizado (temporário + rename atômico)."""
+        tmp_path = output_path.with_suffix(f".{uuid.uuid4().hex}.tmp")
+        try:
+            tmp_path.write_bytes(audio)
+            os.replace(tmp_path, output_path)
+        finally:
+            if tmp_path.exists():
+                tmp_path.unlink()
+
+    def get_cached_audio(self, text: str) -> Path | None:
+        """Caminho do áudio já sintetizado para o texto (marcando o uso), ou None."""
+        output_path = settings.AUDIO_DIR / self._get_audio_name(text)
+        return output_path if self._touch(output_path) else None
+
+    async def _register_audio(self, path: Path):
+        """Contabiliza um áudio novo e despeja os antigos se o orçamento estourar."""
+        if self._tts_cache_bytes is not None:
+            self._tts_cache_bytes += path.stat().st_size
+        if self._tts_cache_bytes is None or self._tts_cache_bytes > self.tts_cache_budget:
+            self._tts_cache_bytes = await asyncio.to_thread(self._evict_audio)
+
+    async def stream_speech(self, text: str) -> AsyncGenerator[bytes, None]:
+        """
+        Síntese em stream: devolve os pedaços de MP3 assim que o Edge-TTS os envia,
+        sem esperar o áudio inteiro nem passar pelo disco.
+        """
+        communicate = edge_tts.Communicate(text, self.tts_voice, rate=self.tts_rate)
+        async for chunk in communicate.stream():
+            if chunk["type"] == "audio":
+                yield chunk["data"]
+
+    async def speech_chunks(self, text: str) -> AsyncGenerator[bytes, None]:
+        """
+        Áudio do texto em pedaços de MP3, para respostas em stream.
+        HIT no cache: lê do disco. MISS: repassa o stream do Edge-TTS e, se a síntese
+        terminar, grava uma cópia no cache (um stream interrompido não é gravado).
+        """
+        cached = self.get_cached_audio(text)
+        if cached is not None:
+            yield await asyncio.to_thread(cached.read_bytes)
+            return
+
+        parts = []
+        async for chunk in self.stream_speech(text):
+            parts.append(chunk)
+            yield chunk
+
+        if parts:
+            output_path = settings.AUDIO_DIR / self._get_audio_name(text)
+            try:
+                await asyncio.to_thread(self._store_audio, output_path, b"".join(parts))
+                await self._register_audio(output_path)
+            except Exception as e:
+                logger.warning(f"Falha ao gravar áudio no cache: {e}")
+
+    async def speak(self, text: str) -> str:
+        """
+        Gera áudio (TTS) via Edge-TTS (Custo zero de CPU local) com tolerância a falhas.
+        Textos repetidos (ex: respostas vindas do cache semântico) são servidos do disco.
+        """
+        filename = self._get_audio_name(text)
+        # settings.AUDIO_DIR aponta para ./static/audio
+        output_path = settings.AUDIO_DIR / filename
+        # Retorna o caminho relativo para o front acessar via /static/audio/...
+        audio_url = f"/static/audio/{filename}"
+
+        # 1. HIT: mesmo texto + voz + velocidade já sintetizado (utime é um único syscall)
+        if self.get_cached_audio(text) is not None:
+            logger.info(f"♻️ Áudio servido do cache: {filename}")
+            return audio_url
+
+        # 2. A mesma síntese já está em andamento: aguarda o resultado dela
+        inflight = self._tts_inflight.get(filename)
+        if inflight is not None:
+            return audio_url if await asyncio.shield(inflight) else ""
+
+        future = asyncio.get_running_loop().create_future()
+        self._tts_inflight[filename] = future
+        try:
             # Chamada protegida pelo padrão de resiliência
             await self._execute_tts(text, output_path)
+            await self._register_audio(output_path)
 
             logger.info(f"🔊 Áudio gerado com sucesso: {filename}")
-            # Retorna o caminho relativo para o front acessar via /static/audio/...
-            return f"/static/audio/{filename}"
+            future.set_result(True)
+            return audio_url
         except Exception as e:
             logger.error(f"❌ Falha crítica na síntese de voz após tentativas: {e}")
+            future.set_result(False)
             return ""
+        finally:
+            if not future.done():
+                future.set_result(False)
+            del self._tts_inflight[filename]
 
 # Instância Singleton
 audio_service = AudioService()
@@ -1,32 +1,62 @@
+import hashlib
 import logging
-import numpy as np
+import time
 import orjson
-import ollama
 from redis.asyncio import Redis
-from redis.commands.search.field import VectorField, TagField
+from src.app.core.redis import get_redis
+from redis.commands.search.field import VectorField, TagField, TextField
+from redis.commands.search.indexDefinition import IndexDefinition, IndexType
 from redis.commands.search.query import Query
+from redis.exceptions import ResponseError
 from src.app.core.config import settings
+from src.app.prompts.templates import get_prompt_version, normalize_level
+from src.app.services.embedding import QueryEmbedding, embedding_service
+from src.app.utils.lru import LRUCache
+from src.app.utils.text import normalize_query
 
 logger = logging.getLogger("brazuka_cache")
 
 class SemanticCache:
-    def __init__(self):
-        # Inicializa conexão com Redis (modo raw bytes para vetores)
-        self.redis = Redis.from_url(settings.REDIS_URL, decode_responses=False)
-        self.client = ollama.AsyncClient(host=settings.OLLAMA_BASE_URL)
+    def __init__(self, redis: Redis | None = None):
+        # Conexão do pool compartilhado (modo raw bytes para vetores)
+        self.redis = redis or get_redis()
 
-        # Configurações do Índice
-        self.index_name = "brazuka_cache"
-        self.threshold = 0.35 # Limiar de similaridade (0.0 = idêntico, 0.15 = muito parecido)
+        # Configurações do Índice (v3: particionado por nível + versão do prompt + versão da base)
+        self.index_name = "brazuka_cache_v3"
+        self.legacy_index_names = ["brazuka_cache", "brazuka_cache_v2"]
+        self.key_prefix = "cache:sem:"
+        self._index_ready = False # Garantido uma vez por processo (warmup), não a cada turno
+        self.threshold = settings.SEMANTIC_CACHE_THRESHOLD # (0.0 = idêntico, 0.15 = muito parecido)
+
+        # Orçamento e TTL adaptativo: entradas novas vivem pouco, entradas quentes vivem mais
+        self.max_entries = settings.CACHE_MAX_ENTRIES
+        self.base_ttl = settings.CACHE_BASE_TTL
+        self.max_ttl = settings.CACHE_MAX_TTL
+        self.lfu_key = "cache:lfu"  # ZSET doc_id -> contador de hits (política de despejo LFU)
+        self.expiry_key = "cache:expiry"  # ZSET doc_id -> instante de expiração (limpa o LFU de entradas mortas)
+
+        # Namespace de versão da base de conhecimento (incrementado pela ingestão)
+        self.version_key = "cache:kb_version"
+        self._version = 0
+        self._version_checked_at = float("-inf")
+        self._version_refresh = 5.0 # segundos
+
+        # Camada exata (pergunta normalizada + nível): LRU local de vida curta na frente do Redis
+        self.exact_lru = LRUCache(maxsize=settings.EXACT_CACHE_SIZE)
+        self.exact_local_ttl = settings.EXACT_CACHE_LOCAL_TTL
 
     async def create_index(self):
         """
         Cria índice exclusivo para respostas cacheadas no Redis Stack.
-        Operação idempotente (segura para rodar múltiplas vezes).
+        Operação idempotente (segura para rodar múltiplas vezes) e memoizada por processo.
         """
+        if self._index_ready:
+            return
+
         try:
             await self.redis.ft(self.index_name).info()
-        except:
+            self._index_ready = True
+        except ResponseError:
             # Se der erro, é porque o índice não existe. Criamos agora.
             schema = (
                 VectorField("embedding", "HNSW", {
@@ -34,24 +64,171 @@ class SemanticCache:
                     "DIM": 768,
                     "DISTANCE_METRIC": "COSINE"
                 }),
-                TagField("response") # Armazena a resposta textual da IA
+                TagField("level"),            # Partição por nível do aluno
+                TagField("prompt_version"),   # Partição por versão de persona/prompt
+                TagField("kb_version"),       # Namespace da base de conhecimento
+                TextField("response", no_index=True) # Resposta textual da IA (só retornada)
             )
-            await self.redis.ft(self.index_name).create_index(schema)
-            logger.info("✅ Índice de Cache Semântico criado.")
+            definition = IndexDefinition(prefix=[self.key_prefix], index_type=IndexType.HASH)
+            await self.redis.ft(self.index_name).create_index(schema, definition=definition)
+            self._index_ready = True
+            logger.info("✅ Índice de Cache Semântico (particionado) criado.")
+
+            # O índice antigo não tinha prefixo e indexava TODOS os hashes do Redis
+            for legacy in self.legacy_index_names:
+                try:
+                    await self.redis.ft(legacy).dropindex(delete_documents=False)
+                    logger.info(f"🧹 Índice legado '{legacy}' removido.")
+                except ResponseError:
+                    pass
+
+    async def get_version(self) -> int:
+        """Versão atual da base de conhecimento (lida do Redis no máximo a cada poucos segundos)."""
+        now = time.monotonic()
+        if now - self._version_checked_at > self._version_refresh:
+            try:
+                raw = await self.redis.get(self.version_key)
+                self._version = int(raw) if raw else 0
+                self._version_checked_at = now
+            except Exception as e:
+                logger.error(f"Erro ao ler versão do cache: {e}")
+        return self._version
+
+    async def bump_version(self) -> int:
+        """
+        Invalida todas as respostas cacheadas (ex: após nova ingestão de conhecimento).
+        As entradas antigas deixam de casar com o filtro e expiram pelo TTL.
+        """
+        self._version = await self.redis.incr(self.version_key)
+        self._version_checked_at = time.monotonic()
+        self.exact_lru.clear()
+        logger.info(f"🔄 Versão do cache incrementada para {self._version}")
+        return self._version
+
+    def _get_ttl(self, hits: int) -> int:
+        """TTL adaptativo: dobra a cada hit, limitado ao máximo configurado."""
+        return min(self.max_ttl, self.base_ttl * 2 ** min(hits, 16))
+
+    def _get_partition_filter(self, level: str, version: int) -> str:
+        """Pré-filtro TAG do KNN: só compara com respostas do mesmo nível, prompt e base."""
+        return (
+            f"(@level:{{{level}}} @prompt_version:{{{get_prompt_version(level)}}}"
+            f" @kb_version:{{{version}}})"
+        )
+
+    def _get_digest(self, query: str, level: str, *extra) -> str:
+        """Hash de conteúdo estável entre processos (ao contrário do hash() do Python)."""
+        parts = [level, get_prompt_version(level), *map(str, extra), normalize_query(query)]
+        return hashlib.sha256("\x00".join(parts).encode("utf-8")).hexdigest()
+
+    async def _get_exact_key(self, query: str, level: str) -> str:
+        level = normalize_level(level)
+        return f"cache:exact:{self._get_digest(query, level, await self.get_version())}"
+
+    def _get_doc_id(self, query: str, level: str) -> str:
+        # Sem a versão na chave: uma nova versão sobrescreve a entrada antiga da mesma pergunta
+        return f"{self.key_prefix}{level}:{self._get_digest(query, level)}"
+
+    async def check_exact(self, query: str, level: str) -> str | None:
+        """
+        Caminho rápido: pergunta idêntica (após normalização) para o mesmo nível.
+        Um único GET no Redis, precedido por um LRU em memória. Nenhum embedding.
+        """
+        key = await self._get_exact_key(query, level)
 
-    async def check_cache(self, query: str) -> str | None:
+        entry = self.exact_lru.get(key)
+        if entry is not None:
+            expires_at, response = entry
+            if expires_at > time.monotonic():
+                return response
+            self.exact_lru.pop(key)
+
+        try:
+            raw = await self.redis.get(key)
+        except Exception as e:
+            logger.error(f"Erro ao verificar cache exato: {e}")
+            return None
+
+        if raw is None:
+            return None
+
+        response = raw.decode("utf-8")
+        self.exact_lru.set(key, (time.monotonic() + self.exact_local_ttl, response))
+        return response
+
+    async def save_exact(self, query: str, response: str, level: str, ttl: int | None = None):
+        """Grava a resposta na camada exata (usado também para promover hits semânticos)."""
+        key = await self._get_exact_key(query, level)
+        try:
+            await self.redis.set(key, response, ex=ttl or self.base_ttl)
+            self.exact_lru.set(key, (time.monotonic() + self.exact_local_ttl, response))
+        except Exception as e:
+            logger.error(f"Erro ao salvar no cache exato: {e}")
+
+    async def _register_hit(self, doc_id: str, hits: int) -> int:
+        """Incrementa a popularidade da entrada e estica seu TTL. Retorna o novo TTL."""
+        hits += 1
+        ttl = self._get_ttl(hits)
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.hincrby(doc_id, "hits", 1)
+        pipe.zincrby(self.lfu_key, 1, doc_id)
+        pipe.expire(doc_id, ttl)
+        pipe.zadd(self.expiry_key, {doc_id: time.time() + ttl})
+        await pipe.execute()
+        return ttl
+
+    async def _prune_expired(self):
+        """Tira do ranking LFU as entradas que já expiraram pelo TTL (senão ocupam o orçamento)."""
+        expired = await self.redis.zrangebyscore(self.expiry_key, "-inf", time.time())
+        if expired:
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.zrem(self.lfu_key, *expired)
+            pipe.zrem(self.expiry_key, *expired)
+            await pipe.execute()
+
+    async def _evict(self, protected: str):
+        """Despejo LFU: remove as entradas menos acessadas quando o orçamento estoura."""
+        await self._prune_expired()
+        excess = await self.redis.zcard(self.lfu_key) - self.max_entries
+        if excess <= 0:
+            return
+
+        candidates = await self.redis.zrange(self.lfu_key, 0, excess)
+        victims = [doc_id for doc_id in candidates if doc_id.decode() != protected][:excess]
+        if victims:
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.delete(*victims)
+            pipe.zrem(self.lfu_key, *victims)
+            pipe.zrem(self.expiry_key, *victims)
+            await pipe.execute()
+            logger.info(f"🧹 Cache LFU: {len(victims)} entradas despejadas")
+
+    async def _get_vector(self, query: str, embedding: QueryEmbedding | None) -> bytes:
+        """Reaproveita o embedding do turno quando disponível; senão vetoriza a pergunta."""
+        if embedding is not None:
+            return await embedding.as_bytes()
+        return (await embedding_service.embed(query)).tobytes()
+
+    async def check_cache(
+        self,
+        query: str,
+        embedding: QueryEmbedding | None = None,
+        level: str = "beginner"
+    ) -> str | None:
         """
-        Verifica se existe uma resposta cacheada semanticamente similar.
+        Verifica se existe uma resposta cacheada semanticamente similar
+        DENTRO da partição do nível do aluno (e da versão atual do prompt).
         Retorna a string da resposta ou None (Cache Miss).
         """
+        level = normalize_level(level)
         try:
-            # 1. Vetoriza a pergunta atual do usuário
-            resp = await self.client.embeddings(model="nomic-embed-text", prompt=query)
-            vec = np.array(resp['embedding'], dtype=np.float32).tobytes()
+            # 1. Vetoriza a pergunta atual do usuário (ou usa o vetor já calculado no turno)
+            vec = await self._get_vector(query, embedding)
+            version = await self.get_version()
 
-            # 2. Busca no Redis (KNN - Vizinho mais próximo)
-            q = Query(f"*=>[KNN 1 @embedding $vec AS score]")\
-                .return_fields("response", "score")\
+            # 2. Busca híbrida no Redis: pré-filtro TAG + KNN (Vizinho mais próximo)
+            q = Query(f"{self._get_partition_filter(level, version)}=>[KNN 1 @embedding $vec AS score]")\
+                .return_fields("response", "hits", "score")\
                 .dialect(2)
 
             res = await self.redis.ft(self.index_name).search(q, query_params={"vec": vec})
@@ -71,6 +248,8 @@ class SemanticCache:
 
                     # Garante que funciona tanto se o Redis retornar bytes quanto string
                     if raw_content:
+                        hits = int(getattr(doc, 'hits', 0) or 0)
+                        await self._register_hit(doc.id, hits)
                         if isinstance(raw_content, bytes):
                             return raw_content.decode("utf-8")
                         return str(raw_content)
@@ -82,26 +261,43 @@ class SemanticCache:
             logger.error(f"Erro ao verificar cache: {e}")
             return None
 
-    async def save_cache(self, query: str, response: str):
+    async def save_cache(
+        self,
+        query: str,
+        response: str,
+        embedding: QueryEmbedding | None = None,
+        level: str = "beginner"
+    ):
         """
         Salva a pergunta (vetor) e a resposta (texto) no Redis.
-        Define um TTL para evitar dados obsoletos.
+        Entradas novas nascem com TTL curto (que cresce a cada hit) e entram
+        no ranking LFU que mantém o cache dentro do orçamento de entradas.
         """
+        level = normalize_level(level)
+        await self.save_exact(query, response, level)
+
         try:
-            resp = await self.client.embeddings(model="nomic-embed-text", prompt=query)
-            vec = np.array(resp['embedding'], dtype=np.float32).tobytes()
+            vec = await self._get_vector(query, embedding)
+            version = await self.get_version()
 
-            # Gera um ID determinístico para a chave
-            doc_id = f"cache:{hash(query)}"
+            # Chave determinística (sha256 do conteúdo): todos os workers escrevem na mesma entrada
+            doc_id = self._get_doc_id(query, level)
 
-            await self.redis.hset(doc_id, mapping={
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.hset(doc_id, mapping={
                 "embedding": vec,
-                "response": response
+                "response": response,
+                "level": level,
+                "prompt_version": get_prompt_version(level),
+                "kb_version": version,
+                "hits": 0
             })
+            pipe.expire(doc_id, self.base_ttl)
+            pipe.zadd(self.lfu_key, {doc_id: 0})
+            pipe.zadd(self.expiry_key, {doc_id: time.time() + self.base_ttl})
+            await pipe.execute()
 
-            # TTL: Cache expira em 1 hora (3600 segundos)
-            # Isso é crucial em sistemas distribuídos para gestão de memória
-            await self.redis.expire(doc_id, 3600)
+            await self._evict(protected=doc_id)
 
         except Exception as e:
             logger.error(f"Erro ao salvar no cache: {e}")
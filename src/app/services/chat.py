@@ -1,99 +1,345 @@
+import asyncio
+import uuid
 from typing import AsyncGenerator
 # ALTERAÇÃO: Importando o logger estruturado SOTA
 from src.app.core.logging import logger
-from src.app.services.llm import llm_service
-from src.app.services.router import router_service
+from src.app.services.llm import LLMUnavailable, llm_service
+from src.app.services.router import RouteDecision, router_service
 from src.app.services.memory import memory_service
+from src.app.services.summary import summary_service
 from src.app.rag.retriever import vector_store  # Motor de Busca Vetorial
 from src.app.services.cache import cache_service
+from src.app.services.embedding import QueryEmbedding, embedding_service
+from src.app.services.jobs import job_queue
+from src.app.services.admission import admission_controller, AdmissionRejected
+from src.app.services.singleflight import StreamFlight, single_flight
+from src.app.services.streaming import StreamEvent
+from src.app.utils.text import normalize_query
+from src.app.utils.tokens import estimate_messages_tokens
 from src.app.prompts.templates import (
-    get_system_prompt,
-    get_few_shot_messages,
+    get_prompt_prefix,
+    get_prompt_version,
+    get_turn_message,
+    normalize_level,
     build_elite_mcp  # Framework de MCP Dinâmico
 )
 
+class PreGenerationStages:
+    """
+    Etapas independentes que antecedem a geração, disparadas TODAS de uma vez:
+    embedding, roteador, busca RAG especulativa e leitura da sessão (resumo + histórico).
+    O tempo até o primeiro token passa a ser o da etapa mais lenta, não a soma de todas.
+    """
+
+    def __init__(
+        self,
+        user_message: str,
+        session_id: str,
+        query_embedding: QueryEmbedding | None,
+        decision: RouteDecision | None = None
+    ):
+        self.session = asyncio.create_task(memory_service.load_session(session_id))
+
+        if decision is not None:
+            # Decisão léxica já tomada em process_message: o roteador vetorial nem é chamado
+            self.decision = asyncio.get_running_loop().create_future()
+            self.decision.set_result(decision)
+        else:
+            self.decision = asyncio.create_task(router_service.decide(user_message, embedding=query_embedding))
+
+        # Sem embedding (caminho rápido de chitchat) não há busca RAG
+        self.knowledge: asyncio.Task | None = None
+        if query_embedding is not None:
+            query_embedding.start()
+            # Especulativa: só é aproveitada se a intenção for rag_ingles
+            self.knowledge = asyncio.create_task(vector_store.search(user_message, embedding=query_embedding))
+
+    def cancel(self, *tasks: asyncio.Future | None):
+        """Cancela as etapas perdedoras (todas, se nenhuma for indicada)."""
+        for task in tasks or (self.session, self.decision, self.knowledge):
+            if task is None:
+                continue
+            if task.done():
+                # Consome a exceção para não gerar "Task exception was never retrieved"
+                if not task.cancelled():
+                    task.exception()
+            else:
+                task.cancel()
+
 class ChatService:
+    async def _persist_turn(self, session_id: str, user_message: str, assistant_message: str):
+        """Enfileira a gravação do histórico; se a fila cair, grava direto (sem perder o turno)."""
+        # Id do turno: torna a gravação idempotente (retries do job não duplicam o histórico)
+        turn_id = uuid.uuid4().hex
+        if not await job_queue.enqueue("persist_turn", session_id, user_message, assistant_message, turn_id):
+            await memory_service.append_turn(session_id, user_message, assistant_message, turn_id)
+
     async def process_message(
         self,
         user_message: str,
         session_id: str,
         student_level: str = "beginner"
-    ) -> AsyncGenerator[str, None]:
+    ) -> AsyncGenerator[str | StreamEvent, None]:
         """
         Orquestrador Principal:
         1. Verifica Cache Semântico (Resposta Imediata).
         2. Roteia a intenção.
         3. Realiza busca RAG (Recuperação de Conhecimento).
-        4. Recupera o histórico do Redis.
-        5. Invoca o LLM em Streaming e persiste os dados.
+        4. Recupera o histórico do Redis (janela fixa ou orçamento de tokens).
+           (1-4 rodam em paralelo; as etapas perdedoras são canceladas)
+        5. Invoca o LLM em Streaming e enfileira a persistência (worker arq).
+        Emite tokens (str) e eventos de controle (StreamEvent: `queued`, `done`) para a camada SSE.
         """
 
         # --- CONFIGURAÇÃO DE LOG ESTRUTURADO (Observabilidade SOTA) ---
         # Vincula o session_id a todos os logs gerados nesta execução
         log = logger.bind(session_id=session_id, student_level=student_level)
 
-        # --- 0. CACHE SEMÂNTICO (Camada de Hiper-Velocidade) ---
-        await cache_service.create_index()
-
-        cached_response = await cache_service.check_cache(user_message)
+        # --- 0. CACHE EXATO (GET único, antes de qualquer embedding) ---
+        cached_response = await cache_service.check_exact(user_message, student_level)
         if cached_response:
-            log.info("🚀 [SOTA] CACHE HIT", query=user_message[:30])
+            log.info("⚡ CACHE HIT EXATO", query=user_message[:30])
             yield cached_response
+            yield StreamEvent("done", {"cache": "exact", "intent": None, "ok": True})
 
-            # PERSISTÊNCIA NA MEMÓRIA DE SESSÃO
-            await memory_service.add_message(session_id, "user", user_message)
-            await memory_service.add_message(session_id, "assistant", cached_response)
+            await self._persist_turn(session_id, user_message, cached_response)
 
             return
 
+        # Caminho rápido léxico (sem embedding): saudações óbvias não precisam de vetor,
+        # cache semântico nem RAG. Repetições continuam cobertas pelo cache exato.
+        lexical_decision = router_service.decide_lexical(user_message)
+        query_embedding = None
+        if lexical_decision is None or lexical_decision.intent != "chitchat":
+            # Embedding do turno: calculado uma única vez e compartilhado por cache, roteador e RAG
+            query_embedding = embedding_service.context(user_message)
+        # Roteador, RAG e sessão começam já, em paralelo com a consulta ao cache semântico
+        stages = PreGenerationStages(user_message, session_id, query_embedding, decision=lexical_decision)
+
+        # Até a geração assumir as etapas (líder), quem as dispara é responsável por cancelá-las:
+        # cache hit, seguidor de outra geração ou cliente que desconectou no meio do caminho
+        handed_off = False
+        try:
+            # --- 0.1 CACHE SEMÂNTICO (Camada de Hiper-Velocidade) ---
+            # O índice é garantido uma única vez no warmup do startup (ver main.py)
+            cached_response = None
+            if query_embedding is not None:
+                cached_response = await cache_service.check_cache(
+                    user_message,
+                    embedding=query_embedding,
+                    level=student_level
+                )
+            if cached_response:
+                log.info("🚀 [SOTA] CACHE HIT", query=user_message[:30])
+                stages.cancel()
+                yield cached_response
+                yield StreamEvent("done", {"cache": "semantic", "intent": None, "ok": True})
+
+                # Promove para a camada exata: a próxima repetição nem chega a vetorizar
+                await cache_service.save_exact(user_message, cached_response, student_level)
+
+                # PERSISTÊNCIA NA MEMÓRIA DE SESSÃO (background)
+                await self._persist_turn(session_id, user_message, cached_response)
+
+                return
+
+            # --- 0.2 SINGLE-FLIGHT (perguntas idênticas simultâneas viram UMA geração) ---
+            flight, is_leader = single_flight.join(self._get_flight_key(user_message, student_level))
+            if is_leader:
+                flight.task = asyncio.create_task(
+                    self._produce(flight, user_message, session_id, student_level, query_embedding, stages, log)
+                )
+                handed_off = True
+            else:
+                log.info("🔗 Seguindo geração já em andamento", query=user_message[:30])
+        finally:
+            if not handed_off:
+                stages.cancel()
+
+        # Líder e seguidores consomem o mesmo stream (replay do que já saiu + tokens ao vivo)
+        async for chunk in flight.subscribe():
+            yield chunk
+        yield StreamEvent("done", {"cache": None, "coalesced": not is_leader, "ok": flight.succeeded, **flight.meta})
+
+        # PERSISTÊNCIA NA MEMÓRIA DE SESSÃO: cada aluno grava o próprio turno
+        if flight.succeeded:
+            await self._persist_turn(session_id, user_message, flight.text())
+
+    async def _save_response_cache(
+        self,
+        user_message: str,
+        response: str,
+        student_level: str,
+        query_embedding: QueryEmbedding | None,
+        log
+    ):
+        """Enfileira a gravação no cache semântico; falhas aqui nunca afetam a resposta entregue."""
+        if query_embedding is None:
+            # Caminho rápido léxico: sem vetor, a resposta vai só para a camada exata
+            await cache_service.save_exact(user_message, response, student_level)
+            return
+
+        # O vetor do turno vai junto para o worker não precisar vetorizar de novo
+        vector = None
+        try:
+            vector = await query_embedding.as_bytes()
+        except Exception as e:
+            log.warning("⚠️ Embedding do turno indisponível: o cache vetoriza de novo", error=str(e))
+
+        try:
+            queued = await job_queue.enqueue("save_cache", user_message, response, student_level, vector)
+            if not queued:
+                await cache_service.save_cache(
+                    user_message,
+                    response,
+                    embedding=query_embedding if vector is not None else None,
+                    level=student_level
+                )
+        except Exception as e:
+            log.error("❌ Falha ao gravar no cache", error=str(e))
+
+    def _get_flight_key(self, user_message: str, student_level: str) -> str:
+        return f"{normalize_level(student_level)}\x00{normalize_query(user_message)}"
+
+    async def _produce(
+        self,
+        flight: StreamFlight,
+        user_message: str,
+        session_id: str,
+        student_level: str,
+        query_embedding: QueryEmbedding | None,
+        stages: PreGenerationStages,
+        log
+    ):
+        """
+        Geração propriamente dita (roteamento, RAG, prompt, LLM) publicada no flight.
+        Roda numa task própria para que todos os ouvintes recebam o mesmo stream.
+        """
+        try:
+            async for chunk in self._generate(user_message, session_id, student_level, query_embedding, stages, log, flight):
+                await flight.publish(chunk)
+        except asyncio.CancelledError:
+            # Todos os clientes saíram: a resposta parcial NÃO vai para cache nem memória
+            log.info("🔌 Geração abortada (clientes desconectados)", partial_chars=len(flight.text()))
+            stages.cancel()
+            flight.succeeded = False
+            raise
+        except LLMUnavailable:
+            # Resposta parcial + desculpa: o aluno vê o aviso, mas nada vai para cache nem memória
+            stages.cancel()
+            flight.succeeded = False
+            await flight.publish("Sorry, I'm having trouble thinking right now. Could you repeat that?")
+        except Exception as e:
+            log.error("❌ Erro no fluxo de orquestração", error=str(e))
+            stages.cancel()
+            flight.succeeded = False
+            await flight.publish("I'm sorry, I couldn't process that. Please try again.")
+        finally:
+            single_flight.finish(flight)
+            await flight.close()
+
+    async def _generate(
+        self,
+        user_message: str,
+        session_id: str,
+        student_level: str,
+        query_embedding: QueryEmbedding | None,
+        stages: PreGenerationStages,
+        log,
+        flight: StreamFlight
+    ) -> AsyncGenerator[str | StreamEvent, None]:
+
         # --- 1. ROTEAMENTO SEMÂNTICO ---
-        intent = await router_service.decide(user_message)
-        log.info("✨ Intenção detectada", intent=intent)
+        decision = await stages.decision
+        intent = decision.intent
+        # Cada intenção tem seu perfil de geração (chitchat: modelo rápido e respostas curtas)
+        profile = llm_service.get_profile(intent)
+        flight.meta = {"intent": intent, "model": profile.model}
+        log.info("✨ Intenção detectada", intent=intent, route_path=decision.path, model=profile.model)
 
         # --- 2. RECUPERAÇÃO DE CONHECIMENTO (RAG) ---
+        # A busca já foi disparada junto com o roteador; chitchat simplesmente a descarta
         knowledge_context = []
-        if intent == "rag_ingles":
-            knowledge_context = await vector_store.search(user_message)
+        if intent == "rag_ingles" and stages.knowledge is not None:
+            knowledge_context = await stages.knowledge
             log.info("📚 Busca RAG realizada", items_found=len(knowledge_context))
+        else:
+            stages.cancel(stages.knowledge)
+
+        # Resumo + histórico bruto (lidos em paralelo com as etapas acima)
+        summary, raw_history, summary_pending = await stages.session
 
-        # --- 3. RECUPERAÇÃO DE MEMÓRIA (Redis) ---
-        history = await memory_service.get_history(session_id)
+        # --- 3. ENGENHARIA DE CONTEXTO (TEMPLATES & MCP) ---
+        # Prefixo estável (constituição + persona + few-shots): idêntico byte a byte a cada turno,
+        # o que permite ao Ollama reaproveitar o KV cache. É a ÚNICA mensagem system: os templates
+        # de chat juntam todas as mensagens system no topo do prompt.
+        prompt_messages = list(get_prompt_prefix(student_level))
 
-        # --- 4. ENGENHARIA DE CONTEXTO (TEMPLATES & MCP) ---
         context_data = build_elite_mcp(
             base_level=student_level,
             retrieved_context=knowledge_context
         )
-
-        system_instructions = get_system_prompt(
+        # Resumo contínuo + contexto recuperado + âncoras finais vão no último turno do aluno,
+        # depois do histórico (o histórico guarda só a mensagem crua)
+        user_turn = get_turn_message(
             level=student_level,
-            context=context_data
+            user_message=user_message,
+            context=context_data,
+            summary=summary if summary_service.enabled else ""
         )
 
+        # --- 4. RECUPERAÇÃO DE MEMÓRIA (Redis) ---
+        # Modo "tokens": o histórico ocupa só o que sobra do num_ctx depois do prompt fixo
+        token_budget = None
+        if memory_service.token_mode:
+            token_budget = max(0, profile.num_ctx
+                               - profile.num_predict
+                               - estimate_messages_tokens(prompt_messages + [user_turn]))
+        history = memory_service.fit_history(raw_history, token_budget=token_budget)
+
         # --- 5. CONSTRUÇÃO DO PAYLOAD ---
-        messages = [{"role": "system", "content": system_instructions}]
-        messages.extend(get_few_shot_messages(level=student_level))
-        messages.extend(history)
-        messages.append({"role": "user", "content": user_message})
+        messages = prompt_messages + history + [user_turn]
 
-        # --- 6. GERAÇÃO DA RESPOSTA (LLM) ---
-        full_response = ""
+        # --- 6. ADMISSÃO (vaga limitada no LLM, fila FIFO, uma geração por sessão) ---
         try:
-            log.info("🧠 Iniciando inferência no LLM")
-            async for chunk in llm_service.chat_stream(messages):
-                full_response += chunk
-                yield chunk
+            ticket = admission_controller.reserve(session_id)
+        except AdmissionRejected as e:
+            log.warning("🚦 Geração recusada", reason=e.reason, retry_after=e.retry_after)
+            yield "O tutor está atendendo muitos alunos agora. Tente novamente em alguns segundos."
+            return
 
-            # --- 7. PERSISTÊNCIA SOTA ---
+        # --- 7. GERAÇÃO DA RESPOSTA (LLM) ---
+        # Acumulação O(n): pedaços numa lista, um único join no final
+        response_parts: list[str] = []
+        try:
+            if ticket.position:
+                yield StreamEvent("queued", {"position": ticket.position})
+            await ticket.acquire()
+            log.info("🧠 Iniciando inferência no LLM", prompt_version=get_prompt_version(student_level))
+            try:
+                async for chunk in llm_service.chat_stream(messages, profile=profile):
+                    response_parts.append(chunk)
+                    yield chunk
+            finally:
+                # A vaga é liberada assim que a geração termina (a persistência não ocupa o LLM)
+                ticket.release()
+
+            full_response = "".join(response_parts)
+
+            # --- 8. PERSISTÊNCIA SOTA (fora do caminho crítico: jobs no worker arq) ---
             if full_response.strip():
-                await cache_service.save_cache(user_message, full_response)
-                await memory_service.add_message(session_id, "user", user_message)
-                await memory_service.add_message(session_id, "assistant", full_response)
-                log.info("💾 Estado sincronizado no Redis")
+                # A resposta já foi entregue: o histórico de cada sessão ouvinte é gravado em
+                # process_message, mesmo que a gravação no cache falhe
+                flight.succeeded = True
+                await self._save_response_cache(user_message, full_response, student_level, query_embedding, log)
+                log.info("💾 Persistência enfileirada")
 
-        except Exception as e:
-            log.error("❌ Erro no fluxo de orquestração", error=str(e))
-            yield "I'm sorry, I couldn't process that. Please try again."
+                # Resumo contínuo em lote, com a vaga do LLM já devolvida (baixa prioridade)
+                if summary_service.should_fold(summary_pending):
+                    summary_service.schedule(session_id)
+
+        finally:
+            ticket.release()
 
 # Instância Singleton do Orquestrador
 chat_service = ChatService()
@@ -0,0 +1,215 @@
+import asyncio
+import hashlib
+import logging
+import numpy as np
+import ollama
+from redis.asyncio import Redis
+from src.app.core.redis import get_redis
+from src.app.core.config import settings
+from src.app.utils.lru import LRUCache
+from src.app.utils.text import normalize_text
+
+logger = logging.getLogger("brazuka_embedding")
+
+class QueryEmbedding:
+    """
+    Contexto de embedding com escopo de requisição.
+    A mensagem do usuário é vetorizada UMA única vez por turno e o mesmo vetor
+    é compartilhado entre Cache Semântico, Roteador e RAG.
+    """
+
+    def __init__(self, text: str, service: "EmbeddingService", vector: np.ndarray | None = None):
+        self.text = text
+        self._service = service
+        self._task: asyncio.Future | None = None
+        # Vetor já conhecido (ex: enviado junto com um job do worker)
+        self._vector = vector
+
+    def start(self):
+        """Dispara o cálculo em background (idempotente) sem esperar o resultado."""
+        if self._vector is None and self._task is None:
+            # Future compartilhada: chamadas concorrentes aguardam o mesmo cálculo
+            self._task = asyncio.ensure_future(self._service.embed(self.text))
+
+    async def vector(self) -> np.ndarray:
+        """Retorna o vetor float32 (calculado na primeira chamada, memoizado depois)."""
+        if self._vector is not None:
+            return self._vector
+        self.start()
+        # shield: cancelar um dos consumidores (ex: RAG especulativo) não cancela o cálculo dos outros
+        return await asyncio.shield(self._task)
+
+    async def as_bytes(self) -> bytes:
+        """Forma binária (FLOAT32) usada nas queries KNN do RediSearch."""
+        return (await self.vector()).tobytes()
+
+class EmbeddingBatcher:
+    """
+    Dispatcher de micro-batching.
+    Acumula pedidos de embedding durante uma janela curta (ou até N itens) e envia
+    tudo em UMA chamada ao endpoint multi-input do Ollama, devolvendo cada vetor
+    para a Future que o aguardava.
+    """
+
+    def __init__(self, client: ollama.AsyncClient, model: str, window_ms: float, max_batch: int):
+        self.client = client
+        self.model = model
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+
+        # texto -> Futures aguardando (textos repetidos na mesma janela viram 1 item)
+        self._pending: dict[str, list[asyncio.Future]] = {}
+        self._timer: asyncio.TimerHandle | None = None
+        # Referências fortes para as tasks de envio (evita coleta pelo GC)
+        self._inflight: set[asyncio.Task] = set()
+
+    async def submit(self, text: str) -> np.ndarray:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.setdefault(text, []).append(future)
+
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        batch, self._pending = self._pending, {}
+        if batch:
+            task = asyncio.create_task(self._dispatch(batch))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _dispatch(self, batch: dict[str, list[asyncio.Future]]):
+        texts = list(batch)
+        error: BaseException = RuntimeError("embedding não resolvido pelo lote")
+        try:
+            resp = await self.client.embed(model=self.model, input=texts)
+            vectors = resp["embeddings"]
+            if len(vectors) != len(texts):
+                raise RuntimeError(f"Ollama devolveu {len(vectors)} embeddings para {len(texts)} textos")
+
+            logger.debug(f"Lote de embeddings enviado: {len(texts)} textos")
+            for text, vector in zip(texts, vectors):
+                vec = np.array(vector, dtype=np.float32)
+                for future in batch[text]:
+                    # Quem desistiu de esperar (cancelado) é ignorado
+                    if not future.done():
+                        future.set_result(vec)
+        except Exception as e:
+            logger.error(f"Falha no lote de embeddings: {e}")
+            error = e
+        finally:
+            # Nenhuma Future pode ficar pendurada (a requisição esperaria para sempre)
+            for futures in batch.values():
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(error)
+
+class EmbeddingService:
+    """
+    Serviço único de embeddings com cache em duas camadas:
+    1. LRU em memória (por processo, latência ~zero).
+    2. Redis (compartilhado entre workers), chave = sha256(modelo + texto normalizado).
+    """
+
+    def __init__(self, redis: Redis | None = None):
+        # Cliente assíncrono para não bloquear o event loop
+        self.client = ollama.AsyncClient(host=settings.OLLAMA_BASE_URL)
+        # Pool compartilhado (modo raw bytes: vetores float32 são armazenados como bytes)
+        self.redis = redis or get_redis()
+
+        self.model = settings.EMBEDDING_MODEL
+        self.ttl = settings.EMBEDDING_CACHE_TTL
+        self.lru = LRUCache(maxsize=settings.EMBEDDING_CACHE_SIZE)
+        self.batcher = EmbeddingBatcher(
+            self.client,
+            self.model,
+            window_ms=settings.EMBEDDING_BATCH_WINDOW_MS,
+            max_batch=settings.EMBEDDING_BATCH_MAX_SIZE
+        )
+
+        # Contadores de observabilidade
+        self.redis_hits = 0
+        self.misses = 0
+
+    def _get_key(self, text: str) -> str:
+        digest = hashlib.sha256(f"{self.model}\x00{text}".encode("utf-8")).hexdigest()
+        return f"emb:{digest}"
+
+    async def _compute(self, text: str) -> np.ndarray:
+        """Chamada real ao Ollama (caminho de cache miss), agrupada pelo batcher."""
+        return await self.batcher.submit(text)
+
+    async def embed(self, text: str) -> np.ndarray:
+        """Gera o vetor numérico (float32) do texto, consultando LRU -> Redis -> Ollama."""
+        # A forma normalizada só entra na chave do cache: o modelo recebe o texto original
+        key = self._get_key(normalize_text(text))
+
+        # 1. Camada local (LRU)
+        vec = self.lru.get(key)
+        if vec is not None:
+            return vec
+
+        # 2. Camada compartilhada (Redis) - falhas aqui não derrubam o fluxo
+        try:
+            raw = await self.redis.get(key)
+            if raw:
+                self.redis_hits += 1
+                vec = np.frombuffer(raw, dtype=np.float32)
+                self.lru.set(key, vec)
+                return vec
+        except Exception as e:
+            logger.warning(f"Cache Redis de embeddings indisponível: {e}")
+
+        # 3. Ollama
+        self.misses += 1
+        try:
+            vec = await self._compute(text)
+        except Exception as e:
+            logger.error(f"Erro ao gerar embedding no Ollama: {e}")
+            raise
+
+        self.lru.set(key, vec)
+        try:
+            await self.redis.set(key, vec.tobytes(), ex=self.ttl)
+        except Exception as e:
+            logger.warning(f"Falha ao gravar embedding no Redis: {e}")
+        return vec
+
+    async def embed_many(self, texts: list[str]) -> list[np.ndarray]:
+        """
+        Vetoriza vários textos de uma vez.
+        Os misses chegam juntos ao batcher e viram poucas chamadas em lote ao Ollama.
+        """
+        return list(await asyncio.gather(*(self.embed(text) for text in texts)))
+
+    async def warmup(self):
+        """Carrega o modelo de embedding no Ollama (ignora o cache de propósito)."""
+        await self.client.embed(model=self.model, input="warmup", keep_alive=settings.OLLAMA_KEEP_ALIVE)
+
+    def context(self, text: str) -> QueryEmbedding:
+        """Cria o contexto de embedding de um turno de chat."""
+        return QueryEmbedding(text, self)
+
+    def context_from_bytes(self, text: str, vector: bytes) -> QueryEmbedding:
+        """Reconstrói o contexto a partir do vetor serializado (FLOAT32), sem chamar o Ollama."""
+        return QueryEmbedding(text, self, vector=np.frombuffer(vector, dtype=np.float32))
+
+    def stats(self) -> dict:
+        """Contadores de hit/miss por camada."""
+        return {
+            "lru_hits": self.lru.hits,
+            "redis_hits": self.redis_hits,
+            "misses": self.misses,
+            "lru_size": len(self.lru),
+        }
+
+# Instância Singleton
+embedding_service = EmbeddingService()
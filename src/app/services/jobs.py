@@ -0,0 +1,40 @@
+import logging
+from arq import create_pool
+from arq.connections import ArqRedis, RedisSettings
+from src.app.core.config import settings
+
+logger = logging.getLogger("brazuka_jobs")
+
+class JobQueue:
+    """
+    Fila de jobs em background (arq sobre o Redis).
+    Tira a persistência pós-resposta do caminho crítico do streaming:
+    o /chat só enfileira e o worker (src/app/worker.py) executa.
+    """
+
+    def __init__(self):
+        self.redis_settings = RedisSettings.from_dsn(settings.REDIS_URL)
+        self.pool: ArqRedis | None = None
+
+    async def _get_pool(self) -> ArqRedis:
+        if self.pool is None:
+            self.pool = await create_pool(self.redis_settings)
+        return self.pool
+
+    async def enqueue(self, function: str, *args, **kwargs) -> bool:
+        """Enfileira um job. Retorna False se a fila estiver indisponível (o chamador decide o fallback)."""
+        try:
+            pool = await self._get_pool()
+            await pool.enqueue_job(function, *args, **kwargs)
+            return True
+        except Exception as e:
+            logger.error(f"Falha ao enfileirar job '{function}': {e}")
+            return False
+
+    async def close(self):
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+
+# Instância Singleton
+job_queue = JobQueue()
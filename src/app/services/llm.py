@@ -1,33 +1,142 @@
+import asyncio
 import logging
 import ollama
+from dataclasses import dataclass
 from typing import AsyncGenerator
 from src.app.core.config import settings
 
 logger = logging.getLogger("brazuka_ai")
 
+@dataclass(frozen=True)
+class ModelProfile:
+  """Modelo + opções de geração usados para uma intenção do roteador."""
+  name: str
+  model: str
+  num_ctx: int
+  num_predict: int
+  temperature: float
+  keep_alive: str
+
+  @property
+  def options(self) -> dict:
+    return {"num_ctx": self.num_ctx, "num_predict": self.num_predict, "temperature": self.temperature}
+
+def _build_profile(name: str, overrides: dict) -> ModelProfile:
+  # chitchat vai para o modelo rápido quando configurado; o resto usa o modelo principal
+  model = settings.LLM_FAST_MODEL if name == "chitchat" and settings.LLM_FAST_MODEL else settings.MODEL_NAME
+  model = overrides.get("model", model)
+
+  # Mesmo modelo principal => mesmo num_ctx (outro valor força o Ollama a recarregar o runner)
+  num_ctx = settings.LLM_NUM_CTX
+  if "num_ctx" in overrides:
+    if model != settings.MODEL_NAME:
+      num_ctx = int(overrides["num_ctx"])
+    else:
+      logger.warning(f"Perfil '{name}': num_ctx ignorado (usa o modelo principal, num_ctx={num_ctx})")
+
+  return ModelProfile(
+      name=name,
+      model=model,
+      num_ctx=num_ctx,
+      num_predict=int(overrides.get("num_predict", settings.LLM_RESPONSE_RESERVE_TOKENS)),
+      temperature=float(overrides.get("temperature", settings.LLM_TEMPERATURE)),
+      keep_alive=overrides.get("keep_alive", settings.OLLAMA_KEEP_ALIVE)
+  )
+
+class LLMUnavailable(Exception):
+  """O Ollama falhou no meio da geração. A resposta (parcial) não pode ir para cache nem memória."""
+
 class LLMService:
   def __init__(self):
     # O cliente oficial do Ollama suporta chamadas assíncronas
     self.client = ollama.AsyncClient(host=settings.OLLAMA_BASE_URL)
     self.model = settings.MODEL_NAME
 
-  async def chat_stream(self, messages: list) -> AsyncGenerator[str, None]:
+    # Perfil padrão (modelo principal) + um perfil por intenção configurada
+    self.default_profile = _build_profile("default", {})
+    self.profiles = {name: _build_profile(name, overrides) for name, overrides in settings.LLM_PROFILES.items()}
+
+    # Gerações abortadas por desconexão do cliente (capacidade de inferência devolvida)
+    self.aborted_generations = 0
+    self.aborted_tokens = 0      # Tokens gerados antes do abort (desperdiçados)
+    self.saved_tokens = 0        # Estimativa de tokens NÃO gerados graças ao abort (até o num_predict)
+
+  def get_profile(self, intent: str | None = None) -> ModelProfile:
+    """Perfil de geração da intenção (intenções sem perfil usam o modelo principal)."""
+    return self.profiles.get(intent, self.default_profile)
+
+  async def warmup(self):
+    """Carrega os modelos de chat na memória do Ollama (prompt vazio = só load) e fixa o keep_alive."""
+    loaded = set()
+    for profile in [self.default_profile, *self.profiles.values()]:
+      if profile.model in loaded:
+        continue
+      # Carrega já com o num_ctx real: outro valor faria a primeira requisição recarregar o modelo
+      await self.client.generate(
+          model=profile.model,
+          prompt="",
+          options={"num_ctx": profile.num_ctx},
+          keep_alive=profile.keep_alive
+      )
+      loaded.add(profile.model)
+
+  async def chat_stream(self, messages: list, profile: ModelProfile | None = None) -> AsyncGenerator[str, None]:
     """
     Gera uma resposta em stream (pedacinho por pedacinho).
     Isso melhora a 'Transparencia de Desempenho' para o usuário.
+    Falhas do Ollama viram LLMUnavailable: quem chama decide a mensagem ao aluno.
     """
+    profile = profile or self.default_profile
+    stream = None
+    generated = 0
 
     try:
-      async for part in await self.client.chat(
-          model=self.model,
+      stream = await self.client.chat(
+          model=profile.model,
           messages=messages,
-          stream=True
-          ):
+          stream=True,
+          options=profile.options,
+          keep_alive=profile.keep_alive
+          )
+      async for part in stream:
+        generated += 1  # Cada chunk do Ollama corresponde a ~1 token
         yield part['message']['content']
+    except (asyncio.CancelledError, GeneratorExit):
+      # Cliente foi embora: fecha o stream HTTP na hora para o Ollama parar de gerar
+      if stream is not None:
+        await stream.aclose()
+      self._record_abort(profile, generated)
+      raise
     except Exception as e:
       logger.error(f"Erro na geração de texto: {e}")
-      yield "Sorry, I'm having trouble thinking rigth now. Could you repeat that?"
+      raise LLMUnavailable(str(e)) from e
+
+  def _record_abort(self, profile: ModelProfile, generated: int):
+    self.aborted_generations += 1
+    self.aborted_tokens += generated
+    self.saved_tokens += max(0, profile.num_predict - generated)
+    logger.info(
+        f"🔌 Geração abortada após {generated} tokens "
+        f"(total economizado ~{self.saved_tokens} tokens em {self.aborted_generations} aborts)"
+    )
+
+  def stats(self) -> dict:
+    """Contadores de gerações abortadas por desconexão."""
+    return {
+        "aborted_generations": self.aborted_generations,
+        "aborted_tokens": self.aborted_tokens,
+        "saved_tokens": self.saved_tokens,
+    }
+
+  async def complete(self, messages: list, max_tokens: int = 256) -> str:
+    """Geração completa (sem stream) para tarefas internas, como o resumo de conversa."""
+    response = await self.client.chat(
+        model=self.model,
+        messages=messages,
+        options={"num_ctx": settings.LLM_NUM_CTX, "num_predict": max_tokens, "temperature": 0.2},
+        keep_alive=settings.OLLAMA_KEEP_ALIVE
+    )
+    return response['message']['content'].strip()
 
 # Instância Singleton para ser injetada
 llm_service = LLMService()
-
@@ -2,46 +2,194 @@ import logging
 import orjson
 from redis.asyncio import Redis
 from src.app.core.config import settings
+from src.app.core.redis import get_redis
+from src.app.utils.tokens import estimate_tokens
 
 logger = logging.getLogger("brazuka_memory")
 
 class MemoryService:
-    def __init__(self):
-        # Conexão assíncrona com o Redis
-        self.redis = Redis.from_url(settings.REDIS_URL, decode_responses=True)
+    def __init__(self, redis: Redis | None = None):
+        # Conexão do pool compartilhado (orjson lê bytes diretamente)
+        self.redis = redis or get_redis()
         # Tempo de vida da memória (ex: 24 horas de inatividade)
         self.ttl = 86400
-        # Limite de mensagens para o contexto (Sliding Window)
-        self.window_size = 10
+        # Limite de mensagens guardadas (Sliding Window)
+        # No modo "tokens" guardamos mais e o corte fino é feito pelo orçamento na leitura
+        self.token_mode = settings.HISTORY_MODE == "tokens"
+        self.window_size = settings.HISTORY_MAX_MESSAGES if self.token_mode else settings.HISTORY_WINDOW_SIZE
+        self._append_turn_script = self.redis.register_script(self.APPEND_TURN_SCRIPT)
+        self._commit_summary_script = self.redis.register_script(self.COMMIT_SUMMARY_SCRIPT)
+
+    def _encode(self, role: str, content: str) -> bytes:
+        # A contagem de tokens é feita UMA vez, na escrita, e guardada junto da mensagem
+        return orjson.dumps({"role": role, "content": content, "tokens": estimate_tokens(content)})
 
     def _get_key(self, session_id: str) -> str:
         return f"history:{session_id}"
 
-    async def add_message(self, session_id: str, role: str, content: str):
-        """Adiciona uma mensagem ao histórico no Redis."""
-        key = self._get_key(session_id)
-        message = {"role": role, "content": content}
+    def _get_summary_key(self, session_id: str) -> str:
+        return f"summary:{session_id}"
+
+    def _get_pending_key(self, session_id: str) -> str:
+        # Mensagens que saíram da janela e ainda não entraram no resumo
+        return f"summary:pending:{session_id}"
+
+    def _get_seq_key(self, session_id: str) -> str:
+        return f"summary:seq:{session_id}"
+
+    # Grava o turno só se o marcador do turno ainda não existir (retry do job não duplica).
+    # O que sai da janela entra na fila de resumo (summary:pending); se a fila passar do teto,
+    # o começo dela é cortado e a sequência do resumo avança (um resumo em andamento fica obsoleto).
+    APPEND_TURN_SCRIPT = """
+    if KEYS[2] ~= '' and not redis.call('SET', KEYS[2], 1, 'NX', 'EX', ARGV[4]) then
+        return -1
+    end
+    redis.call('RPUSH', KEYS[1], ARGV[1], ARGV[2])
+    local evicted = redis.call('LRANGE', KEYS[1], 0, -(tonumber(ARGV[3]) + 1))
+    redis.call('LTRIM', KEYS[1], -tonumber(ARGV[3]), -1)
+    redis.call('EXPIRE', KEYS[1], ARGV[4])
+    if ARGV[5] == '0' then
+        return 0
+    end
+    if #evicted > 0 then
+        redis.call('RPUSH', KEYS[3], unpack(evicted))
+        redis.call('EXPIRE', KEYS[3], ARGV[4])
+    end
+    local pending = redis.call('LLEN', KEYS[3])
+    if pending > tonumber(ARGV[6]) then
+        redis.call('LTRIM', KEYS[3], -tonumber(ARGV[6]), -1)
+        redis.call('INCR', KEYS[4])
+        redis.call('EXPIRE', KEYS[4], ARGV[4])
+        pending = tonumber(ARGV[6])
+    end
+    return pending
+    """
+
+    # Aplica um resumo SOMENTE se ninguém mexeu na fila desde a leitura (mesma sequência):
+    # resumos fora de ordem ou concorrentes são descartados
+    COMMIT_SUMMARY_SCRIPT = """
+    if (redis.call('GET', KEYS[3]) or '0') ~= ARGV[1] then
+        return 0
+    end
+    redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[4])
+    redis.call('LTRIM', KEYS[2], tonumber(ARGV[3]), -1)
+    redis.call('INCR', KEYS[3])
+    redis.call('EXPIRE', KEYS[3], ARGV[4])
+    return 1
+    """
+
+    async def append_turn(
+        self,
+        session_id: str,
+        user_message: str,
+        assistant_message: str,
+        turn_id: str | None = None
+    ) -> int:
+        """
+        Grava um turno completo (pergunta + resposta) em UM único round trip atômico (Lua):
+        RPUSH das duas mensagens, LTRIM da janela e renovação do TTL.
+        Com turn_id, o turno é gravado no máximo uma vez (idempotente para retries).
+        As mensagens que saem da janela vão para a fila do resumo contínuo.
+        Retorna quantas mensagens aguardam resumo.
+        """
+        marker = f"turn:{session_id}:{turn_id}" if turn_id else ""
+        pending = await self._append_turn_script(
+            keys=[
+                self._get_key(session_id),
+                marker,
+                self._get_pending_key(session_id),
+                self._get_seq_key(session_id)
+            ],
+            args=[
+                self._encode("user", user_message),
+                self._encode("assistant", assistant_message),
+                self.window_size,
+                self.ttl,
+                int(settings.HISTORY_SUMMARY_ENABLED),
+                settings.HISTORY_MAX_MESSAGES
+            ]
+        )
+        if pending == -1:
+            logger.info(f"Turno {turn_id} já gravado: ignorando duplicata")
+            return 0
+        return pending
+
+    async def get_pending(self, session_id: str) -> tuple[list, int]:
+        """Mensagens aguardando resumo + sequência atual (para o commit condicional)."""
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.lrange(self._get_pending_key(session_id), 0, -1)
+        pipe.get(self._get_seq_key(session_id))
+        raw_pending, raw_seq = await pipe.execute()
+
+        messages = [
+            {"role": m["role"], "content": m["content"]}
+            for m in map(orjson.loads, raw_pending)
+        ]
+        return messages, int(raw_seq or 0)
+
+    async def commit_summary(self, session_id: str, summary: str, folded: int, seq: int) -> bool:
+        """Grava o novo resumo e tira da fila as `folded` mensagens resumidas. False = obsoleto."""
+        applied = await self._commit_summary_script(
+            keys=[
+                self._get_summary_key(session_id),
+                self._get_pending_key(session_id),
+                self._get_seq_key(session_id)
+            ],
+            args=[seq, summary, folded, self.ttl]
+        )
+        return bool(applied)
+
+    async def get_summary(self, session_id: str) -> str:
+        """Resumo contínuo dos turnos que já saíram da janela ("" se não houver)."""
+        raw = await self.redis.get(self._get_summary_key(session_id))
+        return raw.decode("utf-8") if raw else ""
 
-        # 1. Empurra a mensagem para a lista no Redis
-        await self.redis.rpush(key, orjson.dumps(message))
+    async def load_session(self, session_id: str) -> tuple[str, list, int]:
+        """
+        Resumo + histórico bruto + tamanho da fila de resumo em UM round trip (pipeline sem transação).
+        O corte por orçamento de tokens fica para fit_history, quando o prompt já é conhecido.
+        """
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.get(self._get_summary_key(session_id))
+        pipe.lrange(self._get_key(session_id), 0, -1)
+        pipe.llen(self._get_pending_key(session_id))
+        raw_summary, raw_history, pending = await pipe.execute()
 
-        # 2. Mantém apenas as últimas N mensagens (Sliding Window)
-        await self.redis.ltrim(key, -self.window_size, -1)
+        summary = raw_summary.decode("utf-8") if raw_summary else ""
+        return summary, [orjson.loads(msg) for msg in raw_history], pending
 
-        # 3. Renova o tempo de expiração
-        await self.redis.expire(key, self.ttl)
+    def fit_history(self, history: list, token_budget: int | None = None) -> list:
+        """
+        Formata o histórico para o LLM.
+        Com token_budget: devolve as mensagens MAIS RECENTES que cabem no orçamento.
+        """
+        if token_budget is not None:
+            selected = []
+            used = 0
+            for message in reversed(history):
+                # Mensagens antigas (sem contagem gravada) são estimadas na hora
+                tokens = message.get("tokens") or estimate_tokens(message["content"])
+                if used + tokens > token_budget:
+                    break
+                used += tokens
+                selected.append(message)
+            history = selected[::-1]
 
-    async def get_history(self, session_id: str) -> list:
-        """Recupera o histórico formatado para o LLM."""
-        key = self._get_key(session_id)
-        raw_history = await self.redis.lrange(key, 0, -1)
+            # Evita começar o contexto com uma resposta órfã (sem a pergunta)
+            if history and history[0]["role"] == "assistant":
+                history = history[1:]
 
-        # Converte de JSON (string) para dicionário Python
-        return [orjson.loads(msg) for msg in raw_history]
+        # O LLM só recebe papel e conteúdo
+        return [{"role": m["role"], "content": m["content"]} for m in history]
 
     async def clear_history(self, session_id: str):
         """Apaga o histórico (útil para comandos de reset)."""
-        await self.redis.delete(self._get_key(session_id))
+        await self.redis.delete(
+            self._get_key(session_id),
+            self._get_summary_key(session_id),
+            self._get_pending_key(session_id),
+            self._get_seq_key(session_id)
+        )
 
 # Instância Singleton
 memory_service = MemoryService()
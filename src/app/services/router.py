@@ -1,15 +1,73 @@
+import asyncio
+import hashlib
 import logging
+import re
+from dataclasses import dataclass
 import numpy as np
-import ollama
-from src.app.core.config import settings
+import orjson
+from redis.asyncio import Redis
+from src.app.core.redis import get_redis
+from src.app.services.embedding import QueryEmbedding, embedding_service
+from src.app.utils.text import fold_text
 
 logger = logging.getLogger("brazuka_router")
 
-class SemanticRouter:
-    def __init__(self):
-        # Cliente assíncrono para não bloquear o event loop
-        self.client = ollama.AsyncClient(host=settings.OLLAMA_BASE_URL)
+@dataclass(frozen=True)
+class RouteDecision:
+    """Resultado do roteamento: intenção + caminho que decidiu ('lexical', 'vector' ou 'fallback')."""
+    intent: str
+    path: str
+    score: float = 0.0
+
+class LexicalRouter:
+    """
+    Pré-roteador léxico (sem embedding).
+    Regex compiladas, insensíveis a acento e com fronteira de palavra: decide sozinho
+    os casos óbvios (saudações curtas / marcadores técnicos fortes) e devolve None
+    quando o texto é ambíguo, deixando a decisão para o roteador vetorial.
+    """
+
+    # Mensagem composta SOMENTE por saudações/cortesias (ex: "Oi, tudo bem?")
+    GREETINGS = [
+        "oi", "ola", "opa", "e ai", "eai", "hello", "hi", "hey", "bom dia", "boa tarde",
+        "boa noite", "good morning", "good afternoon", "good evening", "tudo bem", "tudo bom",
+        "tudo joia", "tudo certo", "beleza", "blz", "como vai", "como voce esta",
+        "how are you", "whats up", "what's up", "prazer", "nice to meet you", "obrigado",
+        "obrigada", "valeu", "thanks", "thank you", "tchau", "bye", "professor", "profe"
+    ]
+
+    # Construções que, sozinhas, já caracterizam uma dúvida de inglês
+    STRONG_MARKERS = [
+        r"\bmake\b.*\bdo\b", r"\bdo\b.*\bmake\b", r"\bdiferenca entre\b",
+        r"\bcomo (?:se )?(?:diz|fala|escreve|pronuncia)\b", r"\bo que significa\b",
+        r"\bwhat does .+ mean\b", r"\bhow (?:do|can) (?:i|you) say\b",
+        r"\b(?:esta|ta) (?:certo|certa|correto|correta|errado|errada)\b",
+        r"\bis (?:this|it|that) (?:correct|right|wrong)\b"
+    ]
+
+    def __init__(self, technical_keywords: list[str]):
+        greetings = "|".join(re.escape(g) for g in sorted(self.GREETINGS, key=len, reverse=True))
+        self.greeting_re = re.compile(rf"^(?:(?:{greetings})(?:\s+(?:voce|vc|tu))?[\s,.!?;:]*)+$")
+        self.strong_re = re.compile("|".join(self.STRONG_MARKERS))
+
+        # Ancorada só no início da palavra: cobre flexões ("regras", "verbs", "explained", "tenses").
+        # O grupo captura o radical, então "verb" e "verbs" contam como a mesma palavra técnica.
+        keywords = "|".join(re.escape(fold_text(k)) for k in technical_keywords)
+        self.keyword_re = re.compile(rf"\b({keywords})\w*")
+
+    def count_keywords(self, folded: str) -> int:
+        """Quantidade de palavras técnicas DISTINTAS presentes (pelo radical, com flexões)."""
+        return len(set(self.keyword_re.findall(folded)))
+
+    def classify(self, folded: str) -> str | None:
+        if self.greeting_re.match(folded):
+            return "chitchat"
+        if self.strong_re.search(folded) or self.count_keywords(folded) >= 2:
+            return "rag_ingles"
+        return None
 
+class SemanticRouter:
+    def __init__(self, redis: Redis | None = None):
          # SOTA: Utterances mais ricas e específicas para distanciar os vetores
         self.routes = {
             "chitchat": [
@@ -29,73 +87,156 @@ class SemanticRouter:
         }
 
         # Palavras-chave que indicam intenção técnica (Boosting)
+        # "do" isolado ficou de fora: em português é preposição ("uso do verbo");
+        # o par make/do é tratado como marcador forte no LexicalRouter.
         self.technical_keywords = [
             "grammar", "rule", "verb", "tense", "pronunciation", "meaning",
-            "correct", "difference", "make", "do", "explain", "present",
+            "correct", "difference", "make", "explain", "present",
             "past", "future", "regra", "gramatica", "verbo", "pronuncia",
             "diferença", "explicação", "corrigir", "errado"
         ]
 
-        # Cache para armazenar os centroides (médias matemáticas) de cada rota
-        self.route_centroids = {}
+        # Caminho rápido léxico (roda antes de qualquer embedding)
+        self.lexical = LexicalRouter(self.technical_keywords)
+
+        # Centroides pré-normalizados (uma linha por rota): decide() vira um único produto matriz-vetor
+        self.route_names: list[str] = []
+        self.centroid_matrix: np.ndarray | None = None
+        self._build_lock = asyncio.Lock()
+
+        # Persistência dos centroides (sobrevive a deploys e restarts de worker)
+        self.redis = redis or get_redis()
+
+    def _get_centroids_key(self) -> str:
+        """Chave versionada pelo modelo de embedding + hash do dicionário de rotas."""
+        routes_hash = hashlib.sha256(orjson.dumps(self.routes, option=orjson.OPT_SORT_KEYS)).hexdigest()[:16]
+        return f"router:centroids:{embedding_service.model}:{routes_hash}"
 
     async def _get_embedding(self, text: str):
         """Transforma texto em um vetor numérico usando o modelo nomic."""
         try:
-            resp = await self.client.embeddings(model="nomic-embed-text", prompt=text)
-            return np.array(resp['embedding'])
+            return await embedding_service.embed(text)
         except Exception as e:
             logger.error(f"Erro ao gerar embedding: {e}")
             return None
 
-    def _cosine_similarity(self, v1, v2):
-        """Calcula quão próximos dois vetores estão (1.0 é idêntico, 0.0 é oposto)."""
-        dot_product = np.dot(v1, v2)
-        norm_v1 = np.linalg.norm(v1)
-        norm_v2 = np.linalg.norm(v2)
-        return dot_product / (norm_v1 * norm_v2)
+    def _set_centroids(self, names: list[str], matrix: np.ndarray):
+        # Normaliza cada linha (norma L2 = 1): o produto escalar passa a ser o cosseno
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        self.centroid_matrix = (matrix / np.where(norms == 0, 1, norms)).astype(np.float32)
+        self.route_names = names
+
+    async def _load_centroids(self) -> bool:
+        """Tenta recarregar centroides persistidos no Redis."""
+        try:
+            stored = await self.redis.hgetall(self._get_centroids_key())
+        except Exception as e:
+            logger.warning(f"Não foi possível ler centroides do Redis: {e}")
+            return False
+
+        if not stored:
+            return False
+
+        names = orjson.loads(stored[b"names"])
+        matrix = np.frombuffer(stored[b"matrix"], dtype=np.float32).reshape(len(names), -1)
+        self._set_centroids(names, matrix)
+        logger.info("♻️ Centroides do Roteador Semântico recarregados do Redis.")
+        return True
 
     async def _build_centroids(self):
         """
         Calcula a 'média' matemática de cada categoria.
         Isso torna a decisão ultra rápida.
         """
-        for route_name, utterances in self.routes.items():
-            embeddings = []
-            for text in utterances:
-                vec = await self._get_embedding(text)
-                if vec is not None:
-                    embeddings.append(vec)
+        names = list(self.routes)
+        utterances = [text for name in names for text in self.routes[name]]
 
-            if embeddings:
-                # O centroide é a média de todos os vetores daquela categoria
-                self.route_centroids[route_name] = np.mean(embeddings, axis=0)
+        # Todas as utterances seguem juntas (concorrentes) para o batcher de embeddings
+        try:
+            vectors = await embedding_service.embed_many(utterances)
+        except Exception as e:
+            logger.error(f"Erro ao gerar embeddings das rotas: {e}")
+            return
 
+        centroids = []
+        offset = 0
+        for name in names:
+            size = len(self.routes[name])
+            # O centroide é a média de todos os vetores daquela categoria
+            centroids.append(np.mean(vectors[offset:offset + size], axis=0))
+            offset += size
+
+        self._set_centroids(names, np.vstack(centroids))
         logger.info("✅ Centroides do Roteador Semântico gerados com sucesso.")
 
-    async def decide(self, user_input: str) -> str:
+        try:
+            await self.redis.hset(self._get_centroids_key(), mapping={
+                "names": orjson.dumps(names),
+                "matrix": self.centroid_matrix.tobytes()
+            })
+        except Exception as e:
+            logger.warning(f"Não foi possível persistir centroides no Redis: {e}")
+
+    @property
+    def is_ready(self) -> bool:
+        return self.centroid_matrix is not None
+
+    async def warmup(self):
+        """
+        Pré-aquece o roteador no startup (lifespan): recarrega os centroides
+        persistidos ou, se não existirem para este modelo/rotas, gera e persiste.
+        """
+        async with self._build_lock:
+            if self.centroid_matrix is not None:
+                return
+            if not await self._load_centroids():
+                await self._build_centroids()
+
+    def decide_lexical(self, user_input: str) -> RouteDecision | None:
+        """Só o caminho léxico (síncrono, sem embedding): None quando o texto é ambíguo."""
+        lexical_intent = self.lexical.classify(fold_text(user_input))
+        if lexical_intent:
+            logger.info(f"⚡ Roteamento LÉXICO -> {lexical_intent}")
+            return RouteDecision(lexical_intent, "lexical", 1.0)
+        return None
+
+    async def decide(self, user_input: str, embedding: QueryEmbedding | None = None) -> RouteDecision:
         """
         Decide a rota utilizando Weighted Intent Boosting e Hierarquia de Confiança.
+        1. Caminho léxico: casos óbvios decidem sem nenhum embedding.
+        2. Caminho vetorial: se o embedding do turno for informado, não há nova chamada ao Ollama.
         """
-        if not self.route_centroids:
-            await self._build_centroids()
+        lexical_decision = self.decide_lexical(user_input)
+        if lexical_decision:
+            return lexical_decision
+
+        folded = fold_text(user_input)
+
+        if self.centroid_matrix is None:
+            await self.warmup()
+        if self.centroid_matrix is None:
+            return RouteDecision("chitchat", "fallback")
 
-        user_vec = await self._get_embedding(user_input)
+        if embedding is not None:
+            try:
+                user_vec = await embedding.vector()
+            except Exception as e:
+                logger.error(f"Erro ao gerar embedding: {e}")
+                user_vec = None
+        else:
+            user_vec = await self._get_embedding(user_input)
         if user_vec is None:
-            return "chitchat"
+            return RouteDecision("chitchat", "fallback")
 
-        # 1. Cálculo de scores base via Similaridade de Cosseno
-        scores = {}
-        for route_name, centroid in self.route_centroids.items():
-            scores[route_name] = self._cosine_similarity(user_vec, centroid)
+        # 1. Cálculo de scores base via Similaridade de Cosseno (um único produto matriz-vetor)
+        norm = np.linalg.norm(user_vec)
+        similarities = self.centroid_matrix @ (user_vec / norm if norm else user_vec)
+        scores = dict(zip(self.route_names, similarities.tolist()))
 
         # 2. TÉCNICA SOTA: KEYWORD BOOSTING
         # Analisamos a presença de palavras técnicas para "puxar" a intenção para o RAG
-        input_lower = user_input.lower()
-        boost = 0.0
-        for word in self.technical_keywords:
-            if word in input_lower:
-                boost += 0.05
+        # (regex única com fronteira de palavra: "do" não casa dentro de "dormir")
+        boost = 0.05 * self.lexical.count_keywords(folded)
 
         scores["rag_ingles"] += boost
 
@@ -109,20 +250,20 @@ class SemanticRouter:
         # A: RAG possui evidência fortíssima ou presença clara de termos técnicos
         if rag_score >= 0.80:
             logger.info(f"🎯 Roteamento RAG (Alta Confiança: {rag_score:.2f})")
-            return "rag_ingles"
+            return RouteDecision("rag_ingles", "vector", rag_score)
 
         # B: Se Chitchat for forte e superior ao RAG, tratamos como conversa social
         if chat_score > 0.60 and chat_score > rag_score:
             logger.info(f"💬 Roteamento CHITCHAT (Predomínio Social: {chat_score:.2f})")
-            return "chitchat"
+            return RouteDecision("chitchat", "vector", chat_score)
 
         # C: Zona de Dúvida - Se houver qualquer indício técnico (0.55+), o RAG atua como suporte
         if rag_score > 0.75:
             logger.info(f"📚 Roteamento RAG (Dúvida Pedagógica: {rag_score:.2f})")
-            return "rag_ingles"
+            return RouteDecision("rag_ingles", "vector", rag_score)
 
         # D: Fallback de Segurança
-        return "chitchat"
+        return RouteDecision("chitchat", "vector", chat_score)
 
 # Instância Singleton
 router_service = SemanticRouter()
@@ -0,0 +1,88 @@
+import asyncio
+import logging
+from typing import AsyncGenerator
+from src.app.services.streaming import StreamEvent
+
+logger = logging.getLogger("brazuka_singleflight")
+
+class StreamFlight:
+    """
+    Uma geração em andamento com fan-out do stream de tokens.
+    Quem chega atrasado recebe primeiro o que já foi emitido (replay) e depois
+    acompanha os tokens ao vivo. Além de tokens (str), o stream pode levar StreamEvent.
+    """
+
+    def __init__(self, key: str):
+        self.key = key
+        self.chunks: list[str | StreamEvent] = []
+        self.done = False
+        self.succeeded = False  # True só quando a resposta é real (falha do LLM ou desculpa: False)
+        self.subscribers = 0
+        self.abandoned = False  # Todos os ouvintes desconectaram e a geração foi cancelada
+        self.meta: dict = {}  # Metadados da geração (intenção, modelo) para o evento final
+        self.task: asyncio.Task | None = None
+        self._changed = asyncio.Condition()
+
+    async def publish(self, chunk: str | StreamEvent):
+        async with self._changed:
+            self.chunks.append(chunk)
+            self._changed.notify_all()
+
+    async def close(self):
+        async with self._changed:
+            self.done = True
+            self._changed.notify_all()
+
+    def text(self) -> str:
+        return "".join(chunk for chunk in self.chunks if isinstance(chunk, str))
+
+    async def subscribe(self) -> AsyncGenerator[str | StreamEvent, None]:
+        self.subscribers += 1
+        position = 0
+        try:
+            while True:
+                async with self._changed:
+                    await self._changed.wait_for(lambda: position < len(self.chunks) or self.done)
+                    pending = self.chunks[position:]
+                    finished = self.done
+                position += len(pending)
+
+                for chunk in pending:
+                    yield chunk
+
+                if finished and position >= len(self.chunks):
+                    return
+        finally:
+            self.subscribers -= 1
+            # Ninguém mais ouvindo: aborta a geração (libera o Ollama e evita persistir resposta parcial)
+            if self.subscribers == 0 and not self.done and self.task is not None:
+                self.abandoned = True
+                self.task.cancel()
+
+class SingleFlight:
+    """
+    Coalescência de perguntas idênticas em andamento (mesma pergunta normalizada + nível).
+    A primeira requisição vira "líder" e dispara a geração; as demais só assinam o stream.
+    """
+
+    def __init__(self):
+        self._flights: dict[str, StreamFlight] = {}
+
+    def join(self, key: str) -> tuple[StreamFlight, bool]:
+        """Retorna (flight, é_líder)."""
+        flight = self._flights.get(key)
+        if flight is not None and not flight.done and not flight.abandoned:
+            logger.info(f"🔗 Pergunta coalescida com geração em andamento ({flight.subscribers} ouvintes)")
+            return flight, False
+
+        flight = StreamFlight(key)
+        self._flights[key] = flight
+        return flight, True
+
+    def finish(self, flight: StreamFlight):
+        # Só remove se ainda for o flight registrado (uma nova geração pode já ter assumido a chave)
+        if self._flights.get(flight.key) is flight:
+            del self._flights[flight.key]
+
+# Instância Singleton
+single_flight = SingleFlight()
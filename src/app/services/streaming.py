@@ -0,0 +1,118 @@
+import asyncio
+import logging
+import orjson
+from dataclasses import dataclass, field
+from typing import AsyncGenerator, AsyncIterator, Awaitable, Callable
+from src.app.core.config import settings
+
+logger = logging.getLogger("brazuka_streaming")
+
+# Comentário SSE: mantém proxies e load balancers com a conexão aberta durante filas longas
+HEARTBEAT = b": ping\n\n"
+_END = object()
+
+@dataclass(frozen=True)
+class StreamEvent:
+    """Evento de controle no meio do stream de tokens (ex: posição na fila, metadados finais)."""
+    event: str
+    data: dict = field(default_factory=dict)
+
+def format_sse(event: str, data: dict) -> bytes:
+    """Um evento SSE completo: `event:` + `data:` (JSON em uma linha) + linha em branco."""
+    return b"event: " + event.encode("utf-8") + b"\ndata: " + orjson.dumps(data) + b"\n\n"
+
+async def sse_stream(
+    source: AsyncIterator,
+    flush_interval_ms: float | None = None,
+    flush_max_chars: int | None = None,
+    heartbeat: float | None = None,
+    is_disconnected: Callable[[], Awaitable[bool]] | None = None
+) -> AsyncGenerator[bytes, None]:
+    """
+    Camada de framing SSE sobre o stream do orquestrador.
+    - Tokens (str) são agrupados e enviados como `event: token` a cada N ms ou N caracteres,
+      em vez de uma escrita por pedacinho do Ollama (o primeiro token sai na hora).
+    - StreamEvent vira um evento próprio (ex: `queued`, `done`).
+    - Sem nada para enviar por `heartbeat` segundos, manda um comentário de keep-alive.
+    - Com `is_disconnected` (ex: Request.is_disconnected), checa o cliente a cada flush/heartbeat
+      e encerra o stream na hora: a origem é cancelada e, com ela, a geração no Ollama.
+    """
+    interval = (flush_interval_ms if flush_interval_ms is not None else settings.SSE_FLUSH_INTERVAL_MS) / 1000
+    max_chars = flush_max_chars or settings.SSE_FLUSH_MAX_CHARS
+    heartbeat = heartbeat or settings.SSE_HEARTBEAT_SECONDS
+
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def pump():
+        # Lê o stream de origem numa task própria: o timer de flush não depende do próximo token
+        try:
+            async for item in source:
+                queue.put_nowait(item)
+        except Exception as e:
+            queue.put_nowait(e)
+        finally:
+            queue.put_nowait(_END)
+
+    task = asyncio.create_task(pump())
+    buffer: list[str] = []
+    buffered_chars = 0
+    deadline = None
+    first_sent = False
+
+    def drain() -> bytes:
+        nonlocal buffered_chars, deadline, first_sent
+        payload = format_sse("token", {"text": "".join(buffer)})
+        buffer.clear()
+        buffered_chars = 0
+        deadline = None
+        first_sent = True
+        return payload
+
+    try:
+        while True:
+            timeout = max(0.0, deadline - loop.time()) if buffer else heartbeat
+            try:
+                item = await asyncio.wait_for(queue.get(), timeout)
+            except asyncio.TimeoutError:
+                if is_disconnected is not None and await is_disconnected():
+                    logger.info("🔌 Cliente desconectou: encerrando o stream")
+                    return
+                yield drain() if buffer else HEARTBEAT
+                continue
+
+            if item is _END:
+                break
+
+            if isinstance(item, Exception):
+                # Detalhes (endereços, stack) ficam no log do servidor; o cliente recebe um código estável
+                logger.error(f"❌ Erro no stream do chat: {item!r}")
+                if buffer:
+                    yield drain()
+                yield format_sse("error", {"code": "internal_error", "message": "Erro interno ao gerar a resposta."})
+                break
+
+            if isinstance(item, StreamEvent):
+                # Preserva a ordem: tokens pendentes saem antes do evento
+                if buffer:
+                    yield drain()
+                yield format_sse(item.event, item.data)
+                continue
+
+            if not item:
+                continue
+            buffer.append(item)
+            buffered_chars += len(item)
+            if deadline is None:
+                deadline = loop.time() + interval
+            if not first_sent or buffered_chars >= max_chars:
+                if is_disconnected is not None and await is_disconnected():
+                    logger.info("🔌 Cliente desconectou: encerrando o stream")
+                    return
+                yield drain()
+
+        if buffer:
+            yield drain()
+    finally:
+        # Cancela a origem (process_message) se o stream terminou antes dela (ex: desconexão)
+        task.cancel()
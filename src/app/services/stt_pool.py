@@ -0,0 +1,166 @@
+import asyncio
+import logging
+import math
+import multiprocessing
+import os
+import time
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from faster_whisper import BatchedInferencePipeline, WhisperModel
+from src.app.core.config import settings
+
+logger = logging.getLogger("brazuka_stt")
+
+# --- Estado de cada processo worker: UM modelo carregado no initializer ---
+_model: WhisperModel | None = None
+_batched: BatchedInferencePipeline | None = None
+
+def _init_worker(model_size: str, cpu_threads: int):
+    global _model, _batched
+    # compute_type="int8" reduz o uso de RAM pela metade sem perder precisão
+    _model = WhisperModel(model_size, device="cpu", compute_type="int8", cpu_threads=cpu_threads)
+    _batched = BatchedInferencePipeline(model=_model)
+
+def _ping() -> int:
+    """Tarefa vazia: força a subida (e o carregamento do modelo) de um worker."""
+    return os.getpid()
+
+def _run_transcription(
+    audio: str | np.ndarray,
+    options: dict,
+    batch_size: int,
+    submitted_at: float
+) -> tuple[str, float, float]:
+    """Roda no worker. Retorna (texto, espera na fila em s, tempo de decodificação em s)."""
+    started_at = time.time()
+    if batch_size > 1:
+        # Clipes longos: os trechos (VAD) do MESMO áudio são decodificados em lote
+        segments, _ = _batched.transcribe(audio, batch_size=batch_size, **options)
+    else:
+        segments, _ = _model.transcribe(audio, **options)
+    # segments é um gerador preguiçoso: a decodificação de fato acontece aqui
+    text = " ".join(segment.text for segment in segments).strip()
+    return text, started_at - submitted_at, time.time() - started_at
+
+class STTUnavailable(Exception):
+    """Um worker Whisper morreu (ex: OOM). O pool é recriado na próxima chamada."""
+
+class STTOverloaded(Exception):
+    """Fila do STT cheia. Vira HTTP 503 com Retry-After."""
+
+    def __init__(self, retry_after: int):
+        super().__init__("stt_queue_full")
+        self.retry_after = retry_after
+
+class WhisperPool:
+    """
+    Pool de processos dedicados ao Whisper.
+    - Cada processo carrega seu próprio modelo UMA vez (initializer) com cpu_threads
+      dimensionado para a máquina: núcleos divididos entre os workers, sem disputa.
+    - Fila limitada: acima de STT_WORKERS + STT_MAX_QUEUE clipes pendentes, recusa rápida.
+    - Métricas por clipe: espera na fila e tempo de decodificação.
+    """
+
+    def __init__(self):
+        cores = os.cpu_count() or 1
+        self.workers = settings.STT_WORKERS or max(1, cores // 4)
+        self.cpu_threads = settings.STT_CPU_THREADS or max(1, cores // self.workers)
+        self.max_pending = self.workers + settings.STT_MAX_QUEUE
+
+        self.pending = 0
+        self._executor: ProcessPoolExecutor | None = None
+
+        # Métricas agregadas
+        self.clips = 0
+        self.rejected = 0
+        self.total_queue_wait = 0.0
+        self.total_decode = 0.0
+        # Média móvel (EWMA) da decodificação, base do Retry-After
+        self.avg_decode = 2.0
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        # Criação síncrona (sem await no meio): não há como dois requests criarem dois pools
+        if self._executor is None:
+            logger.info(
+                f"📥 Subindo {self.workers} workers STT Whisper ({settings.STT_MODEL_SIZE}, "
+                f"{self.cpu_threads} threads cada)..."
+            )
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                # spawn: processo limpo, sem herdar threads/locks do servidor
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(settings.STT_MODEL_SIZE, self.cpu_threads)
+            )
+        return self._executor
+
+    async def warmup(self):
+        """Sobe os workers e carrega os modelos no startup (fora do caminho da primeira fala)."""
+        executor = self._get_executor()
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(executor, _ping) for _ in range(self.workers)))
+
+    def _retry_after(self) -> int:
+        waves = self.pending / self.workers
+        return max(1, math.ceil(self.avg_decode * waves))
+
+    async def transcribe(self, audio: str | np.ndarray, options: dict, batch_size: int = 1) -> str:
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise STTOverloaded(self._retry_after())
+
+        executor = self._get_executor()
+        try:
+            future = executor.submit(_run_transcription, audio, options, batch_size, time.time())
+        except BrokenProcessPool as e:
+            self._discard_executor(executor)
+            raise STTUnavailable("pool STT quebrado") from e
+
+        # O clipe sai da contagem só quando o worker termina (mesmo se quem esperava cancelar)
+        self.pending += 1
+        loop = asyncio.get_running_loop()
+        future.add_done_callback(lambda _: loop.call_soon_threadsafe(self._release_slot))
+
+        try:
+            text, queue_wait, decode = await asyncio.wrap_future(future)
+        except BrokenProcessPool as e:
+            logger.error("❌ Worker STT morreu (ex: falta de memória): recriando o pool")
+            self._discard_executor(executor)
+            raise STTUnavailable("worker STT morreu") from e
+
+        self.clips += 1
+        self.total_queue_wait += queue_wait
+        self.total_decode += decode
+        self.avg_decode = 0.8 * self.avg_decode + 0.2 * decode
+        logger.info(f"🎙️ STT: fila {queue_wait * 1000:.0f}ms, decodificação {decode * 1000:.0f}ms")
+        return text
+
+    def _release_slot(self):
+        # Agendado no event loop pelo done-callback (que roda na thread do executor)
+        self.pending -= 1
+
+    def _discard_executor(self, executor: ProcessPoolExecutor):
+        """Abandona um pool quebrado; o próximo transcribe sobe um novo."""
+        if self._executor is executor:
+            self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "cpu_threads": self.cpu_threads,
+            "pending": self.pending,
+            "clips": self.clips,
+            "rejected": self.rejected,
+            "avg_queue_wait_ms": round(self.total_queue_wait / self.clips * 1000, 1) if self.clips else 0.0,
+            "avg_decode_ms": round(self.total_decode / self.clips * 1000, 1) if self.clips else 0.0,
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+# Instância Singleton
+whisper_pool = WhisperPool()
@@ -0,0 +1,85 @@
+import asyncio
+import logging
+from redis.exceptions import LockError
+from src.app.core.config import settings
+from src.app.prompts.templates import get_summary_messages
+from src.app.services.admission import admission_controller, AdmissionRejected
+from src.app.services.llm import llm_service
+from src.app.services.memory import memory_service
+
+logger = logging.getLogger("brazuka_summary")
+
+class SummaryService:
+    """
+    Resumo contínuo da conversa.
+    Os turnos que saem da janela de history:{session_id} vão para uma fila
+    (summary:pending:{session_id}) e são "dobrados" em lote num resumo curto
+    (summary:{session_id}), em vez de serem perdidos.
+    """
+
+    def __init__(self):
+        self.enabled = settings.HISTORY_SUMMARY_ENABLED
+        self.max_tokens = settings.HISTORY_SUMMARY_MAX_TOKENS
+        # Só chama o LLM quando há mensagens suficientes na fila (não a cada turno)
+        self.batch = settings.HISTORY_SUMMARY_BATCH
+        # Tempo máximo segurando o lock de uma sessão (uma chamada ao LLM)
+        self.lock_timeout = 120
+        # Referências fortes para as tasks em background (evita coleta pelo GC)
+        self._tasks: set[asyncio.Task] = set()
+
+    def should_fold(self, pending: int) -> bool:
+        return self.enabled and pending >= self.batch
+
+    def schedule(self, session_id: str):
+        """Dispara o resumo em background (no processo da API, atrás do controle de admissão)."""
+        task = asyncio.create_task(self.fold(session_id))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def fold(self, session_id: str):
+        """Incorpora a fila de mensagens despejadas ao resumo atual da sessão."""
+        if not self.enabled:
+            return
+
+        # Lock por sessão: um resumo por vez; se já houver um em andamento, este desiste
+        lock = memory_service.redis.lock(f"lock:summary:{session_id}", timeout=self.lock_timeout)
+        if not await lock.acquire(blocking=False):
+            return
+
+        try:
+            pending, seq = await memory_service.get_pending(session_id)
+            if len(pending) < self.batch:
+                return
+
+            # Baixa prioridade: com alunos esperando pelo LLM, o resumo fica para um próximo turno
+            try:
+                ticket = admission_controller.reserve_background(f"summary:{session_id}")
+            except AdmissionRejected:
+                logger.info("📝 LLM ocupado: resumo adiado")
+                return
+
+            try:
+                summary = await llm_service.complete(
+                    get_summary_messages(await memory_service.get_summary(session_id), pending),
+                    max_tokens=self.max_tokens
+                )
+            finally:
+                ticket.release()
+
+            if not summary:
+                return
+            # Commit condicional: se a fila mudou de sequência no meio do caminho, descarta
+            if await memory_service.commit_summary(session_id, summary, len(pending), seq):
+                logger.info(f"📝 Resumo da sessão atualizado ({len(pending)} mensagens incorporadas)")
+            else:
+                logger.info("📝 Resumo obsoleto descartado (fila mudou durante a geração)")
+        except Exception as e:
+            logger.error(f"Erro ao resumir a sessão: {e}")
+        finally:
+            try:
+                await lock.release()
+            except LockError:
+                pass  # Lock expirou durante a chamada ao LLM (o commit condicional já protegeu o resumo)
+
+# Instância Singleton
+summary_service = SummaryService()
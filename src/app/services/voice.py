@@ -0,0 +1,133 @@
+import asyncio
+import logging
+from typing import AsyncGenerator
+from src.app.core.config import settings
+from src.app.services.audio import audio_service
+from src.app.services.chat import chat_service
+from src.app.services.stt_pool import STTOverloaded, STTUnavailable
+from src.app.services.streaming import StreamEvent
+from src.app.utils.text import SentenceSplitter
+
+logger = logging.getLogger("brazuka_voice")
+
+_END = object()
+
+class VoiceService:
+    """
+    Pipeline de voz de um turno: STT -> LLM (stream) -> TTS por frase.
+    A síntese da frase 1 começa enquanto o LLM ainda escreve as próximas; o áudio
+    sai na ordem das frases, pedaço por pedaço, assim que fica pronto.
+    """
+
+    def __init__(self):
+        self.min_sentence_chars = settings.VOICE_MIN_SENTENCE_CHARS
+        self.prefetch = settings.VOICE_TTS_PREFETCH
+
+    async def converse(
+        self,
+        audio: bytes,
+        session_id: str,
+        student_level: str = "beginner"
+    ) -> AsyncGenerator[dict | bytes, None]:
+        """Turno completo a partir do áudio do aluno (dicts = eventos JSON, bytes = frames MP3)."""
+        try:
+            text = await audio_service.transcribe(audio)
+        except STTOverloaded as e:
+            yield {"type": "busy", "retry_after": e.retry_after}
+            yield {"type": "done", "ok": False}
+            return
+        except STTUnavailable:
+            yield {"type": "busy", "retry_after": 5}
+            yield {"type": "done", "ok": False}
+            return
+
+        yield {"type": "transcript", "text": text}
+        if not text:
+            yield {"type": "done", "ok": False}
+            return
+
+        async for frame in self.respond(text, session_id, student_level):
+            yield frame
+
+    async def _synthesize(self, sentence: str, chunks: asyncio.Queue, slots: asyncio.Semaphore):
+        try:
+            # Limita quantas frases são sintetizadas ao mesmo tempo (conexões WSS com a Microsoft)
+            async with slots:
+                async for chunk in audio_service.speech_chunks(sentence):
+                    chunks.put_nowait(chunk)
+        except Exception as e:
+            logger.error(f"❌ Falha na síntese da frase: {e}")
+        finally:
+            chunks.put_nowait(None)
+
+    async def respond(
+        self,
+        user_message: str,
+        session_id: str,
+        student_level: str = "beginner"
+    ) -> AsyncGenerator[dict | bytes, None]:
+        """Resposta falada a uma mensagem de texto: tokens, áudio por frase e metadados finais."""
+        outbound: asyncio.Queue = asyncio.Queue()
+        sentences: asyncio.Queue = asyncio.Queue()
+        slots = asyncio.Semaphore(self.prefetch)
+        synth_tasks: list[asyncio.Task] = []
+        meta = {}
+
+        def schedule(sentence: str):
+            chunks: asyncio.Queue = asyncio.Queue()
+            synth_tasks.append(asyncio.create_task(self._synthesize(sentence, chunks, slots)))
+            sentences.put_nowait((sentence, chunks))
+
+        async def run_chat():
+            splitter = SentenceSplitter(self.min_sentence_chars)
+            try:
+                async for item in chat_service.process_message(user_message, session_id, student_level):
+                    if isinstance(item, StreamEvent):
+                        # "done" só sai depois do último áudio
+                        if item.event == "done":
+                            meta.update(item.data)
+                        else:
+                            outbound.put_nowait({"type": item.event, **item.data})
+                        continue
+
+                    outbound.put_nowait({"type": "token", "text": item})
+                    for sentence in splitter.feed(item):
+                        schedule(sentence)
+
+                for sentence in splitter.flush():
+                    schedule(sentence)
+            finally:
+                sentences.put_nowait(None)
+
+        async def run_audio():
+            index = 0
+            while (slot := await sentences.get()) is not None:
+                sentence, chunks = slot
+                outbound.put_nowait({"type": "audio_start", "index": index, "text": sentence})
+                while (chunk := await chunks.get()) is not None:
+                    outbound.put_nowait(chunk)
+                outbound.put_nowait({"type": "audio_end", "index": index})
+                index += 1
+
+        async def run():
+            try:
+                await asyncio.gather(run_chat(), run_audio())
+            except Exception as e:
+                logger.error(f"❌ Erro no pipeline de voz: {e}")
+                meta["ok"] = False
+            finally:
+                outbound.put_nowait(_END)
+
+        supervisor = asyncio.create_task(run())
+        try:
+            while (frame := await outbound.get()) is not _END:
+                yield frame
+            yield {"type": "done", **meta}
+        finally:
+            # Cliente saiu ou interrompeu (barge-in): cancela LLM e sínteses pendentes
+            supervisor.cancel()
+            for task in synth_tasks:
+                task.cancel()
+
+# Instância Singleton
+voice_service = VoiceService()
@@ -0,0 +1,34 @@
+import io
+import wave
+import numpy as np
+from faster_whisper import decode_audio
+
+SAMPLE_RATE = 16000  # Taxa de amostragem esperada pelo Whisper
+
+def decode_pcm(data: bytes) -> np.ndarray:
+    """
+    Decodifica o áudio recebido (em memória) para PCM float32 mono 16 kHz.
+    Caminho rápido: WAV PCM 16-bit mono 16 kHz vira um np.frombuffer, sem FFmpeg.
+    Qualquer outro formato (webm/opus do navegador, mp3, WAV em outra taxa) passa pelo
+    decode_audio do faster-whisper (PyAV) lendo de um BytesIO, sem tocar o disco.
+    """
+    if data[:4] == b"RIFF" and data[8:12] == b"WAVE":
+        try:
+            with wave.open(io.BytesIO(data)) as wav:
+                if (wav.getnchannels(), wav.getsampwidth(), wav.getframerate()) == (1, 2, SAMPLE_RATE):
+                    frames = wav.readframes(wav.getnframes())
+                    return np.frombuffer(frames, dtype=np.int16).astype(np.float32) / 32768.0
+        except wave.Error:
+            pass  # WAV não-PCM (ex: float, ADPCM): segue para o decoder genérico
+
+    return decode_audio(io.BytesIO(data), sampling_rate=SAMPLE_RATE)
+
+def duration_of(pcm: np.ndarray) -> float:
+    """Duração do áudio em segundos."""
+    return len(pcm) / SAMPLE_RATE
+
+def rms_of(pcm: np.ndarray) -> float:
+    """Energia média (RMS) do sinal: perto de zero = silêncio."""
+    if not len(pcm):
+        return 0.0
+    return float(np.sqrt(np.mean(np.square(pcm, dtype=np.float32))))
@@ -0,0 +1,58 @@
+import re
+import unicodedata
+
+def normalize_text(text: str) -> str:
+    """
+    Normalização estável de texto (Unicode NFC + espaços colapsados).
+    Usada para gerar chaves de cache determinísticas.
+    """
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+def fold_text(text: str) -> str:
+    """
+    Forma 'dobrada' para comparação léxica: sem acentos e em caixa baixa.
+    Ex: "Diferença" -> "diferenca".
+    """
+    decomposed = unicodedata.normalize("NFKD", text)
+    return "".join(c for c in decomposed if not unicodedata.combining(c)).casefold()
+
+def normalize_query(text: str) -> str:
+    """
+    Normalização de perguntas para o cache exato: espaços colapsados, caixa baixa
+    e sem pontuação nas pontas ("Make e do?" == "make e do").
+    """
+    return normalize_text(text).casefold().strip(" ?!.,;:")
+
+class SentenceSplitter:
+    """
+    Quebra um stream de tokens em frases completas, à medida que chegam.
+    Frases muito curtas ("Ok.", "Sim!") são juntadas com a próxima para não gerar
+    sínteses de voz minúsculas.
+    """
+
+    # Fim de frase: pontuação seguida de espaço, ou quebra de linha
+    BOUNDARY = re.compile(r"(?<=[.!?…:;])\s+|\n+")
+
+    def __init__(self, min_chars: int = 24):
+        self.min_chars = min_chars
+        self._buffer = ""
+        self._pending = ""
+
+    def feed(self, text: str) -> list[str]:
+        """Recebe um pedaço do stream e devolve as frases que ficaram completas."""
+        self._buffer += text
+        *complete, self._buffer = self.BOUNDARY.split(self._buffer)
+
+        sentences = []
+        for sentence in complete:
+            self._pending = f"{self._pending} {sentence}".strip()
+            if len(self._pending) >= self.min_chars:
+                sentences.append(self._pending)
+                self._pending = ""
+        return sentences
+
+    def flush(self) -> list[str]:
+        """Fim do stream: devolve o que sobrou (frase final sem pontuação, inclusive)."""
+        rest = f"{self._pending} {self._buffer}".strip()
+        self._buffer = self._pending = ""
+        return [rest] if rest else []
@@ -0,0 +1,16 @@
+import math
+import re
+
+# Palavras e pontuação: aproximação leve do tokenizador BPE (sem dependências extras)
+_PIECES = re.compile(r"\w+|[^\w\s]")
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estima a quantidade de tokens de um texto.
+    Cada palavra conta ~1 token a cada 4 caracteres (mínimo 1); cada pontuação conta 1.
+    """
+    return sum(max(1, math.ceil(len(piece) / 4)) for piece in _PIECES.findall(text))
+
+def estimate_messages_tokens(messages: list[dict]) -> int:
+    """Tokens de uma lista de mensagens de chat (+4 por mensagem para os marcadores de papel)."""
+    return sum(estimate_tokens(m["content"]) + 4 for m in messages)
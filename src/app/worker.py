@@ -0,0 +1,49 @@
+"""
+Worker de jobs em background (arq).
+Executa a persistência pós-resposta fora do processo da API:
+
+    uv run arq src.app.worker.WorkerSettings
+"""
+from arq.connections import RedisSettings
+
+from src.app.core.config import settings
+from src.app.core.logging import logger, setup_logging
+from src.app.services.cache import cache_service
+from src.app.services.embedding import embedding_service
+from src.app.services.memory import memory_service
+
+async def persist_turn(
+    ctx,
+    session_id: str,
+    user_message: str,
+    assistant_message: str,
+    turn_id: str | None = None
+):
+    """
+    Grava a pergunta e a resposta no histórico da sessão.
+    Idempotente pelo turn_id: um retry depois de sucesso parcial não duplica o turno.
+    O que sair da janela entra na fila do resumo contínuo (resumida em lote pela API).
+    """
+    pending = await memory_service.append_turn(session_id, user_message, assistant_message, turn_id)
+    logger.info("💾 Histórico persistido", session_id=session_id, summary_pending=pending)
+
+async def save_cache(ctx, query: str, response: str, level: str, vector: bytes | None = None):
+    """
+    Grava a resposta no cache semântico.
+    O vetor do turno viaja junto com o job, então o worker não vetoriza de novo.
+    """
+    embedding = embedding_service.context_from_bytes(query, vector) if vector else None
+    await cache_service.create_index()
+    await cache_service.save_cache(query, response, embedding=embedding, level=level)
+    logger.info("💾 Resposta salva no cache", level=level)
+
+async def startup(ctx):
+    setup_logging()
+
+class WorkerSettings:
+    functions = [persist_turn, save_cache]
+    on_startup = startup
+    redis_settings = RedisSettings.from_dsn(settings.REDIS_URL)
+    # Polling curto: o histórico precisa estar gravado antes do próximo turno do aluno
+    poll_delay = 0.1
+    max_tries = 3
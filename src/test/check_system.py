@@ -19,12 +19,22 @@ def test_chat(msg, label):
                 return ""
 
             print("Recebendo Stream:", end=" ", flush=True)
-            full_text = ""
-            for chunk in r.iter_content(chunk_size=None):
-                if chunk:
-                    text = chunk.decode("utf-8")
-                    print(text, end="", flush=True)
-                    full_text += text
+            parts = []
+            event = None
+            # Stream SSE: "event: <tipo>" seguido de "data: <json>"; linhas ": ping" são keep-alive
+            for line in r.iter_lines(decode_unicode=True):
+                if line.startswith("event:"):
+                    event = line[6:].strip()
+                elif line.startswith("data:"):
+                    data = json.loads(line[5:])
+                    if event == "token":
+                        print(data["text"], end="", flush=True)
+                        parts.append(data["text"])
+                    elif event == "queued":
+                        print(f"[fila: posição {data['position']}]", end=" ", flush=True)
+                    elif event == "done":
+                        print(f"\n📦 Metadados: {data}", end="")
+            full_text = "".join(parts)
 
         end = time.time()
         print(f"\n\n⏱️ Tempo Total: {end - start:.4f}s")